@@ -1,17 +1,32 @@
-import __fonts_public_pb2__
-import generate_images
+import __instrument__
 
 import numpy as np
 import os.path as op
-import glob
 import re
-import pandas as pd
 from tqdm import tqdm
 import json
-from google.protobuf import text_format
+import signal
+import hashlib
+import os
+import time
+from collections import deque
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# protobuf, pandas, and generate_images are only imported by the functions that need them, so that validation workers
+# don't load protobuf or pandas, and nothing imports the generation code until a font is tested
+
+# version of the validation logic, which is part of the key that cached results are stored under - bump this whenever a change to
+# font_succeeds (or the generate_images functions it uses, e.g., check_canvas_bounds) can change which fonts pass
+# (2: check_canvas_bounds checks the bottom edge against the canvas height)
+validation_version = 2
 
 # function to import the metadata file
 def get_pb_metadata(pb_path):
+    import __fonts_public_pb2__
+    from google.protobuf import text_format
+
     with open(pb_path, 'r', encoding='utf-8') as f:
         f_dat = f.read()
     
@@ -20,7 +35,73 @@ def get_pb_metadata(pb_path):
 
     return(pb_metadata)
 
+# function to get the fields that are used from a metadata file, as a json-friendly dict
+def get_metadata_fields(pb_path):
+    m = get_pb_metadata(pb_path)
+    return {'name': m.name, 'category': list(m.category), 'subsets': list(m.subsets),
+            'fonts': [{'filename': fd.filename, 'style': fd.style, 'weight': fd.weight} for fd in m.fonts]}
+
+# function to convert the dict from get_metadata_fields to an object with the same attributes as the metadata (for get_regular_ttf)
+def metadata_from_fields(fields):
+    return SimpleNamespace(name=fields['name'], category=fields['category'], subsets=fields['subsets'],
+                           fonts=[SimpleNamespace(**fd) for fd in fields['fonts']])
+
+# function to find every font directory (google-fonts/<licence>/<family>) in a single walk of the repository
+# returns a dict of font directory: list of metadata (.pb) files, for every directory that contains at least one .ttf file
+# (hidden files and directories are skipped, as with glob)
+def scan_font_dirs(location=''):
+    font_dirs = {}
+    with os.scandir(op.join(location, 'google-fonts')) as licence_entries:
+        for licence_entry in licence_entries:
+            if licence_entry.name.startswith('.') or not licence_entry.is_dir():
+                continue
+            with os.scandir(licence_entry.path) as family_entries:
+                for family_entry in family_entries:
+                    if family_entry.name.startswith('.') or not family_entry.is_dir():
+                        continue
+                    has_ttf, pb_paths = False, []
+                    with os.scandir(family_entry.path) as file_entries:
+                        for file_entry in file_entries:
+                            if file_entry.name.startswith('.'):
+                                continue
+                            has_ttf = has_ttf or file_entry.name.endswith('.ttf')
+                            if file_entry.name.endswith('.pb'):
+                                pb_paths.append(file_entry.path)
+                    if has_ttf:
+                        font_dirs[family_entry.path] = pb_paths
+    return font_dirs
+
+# function to read the fields from a list of metadata files, parsing them in a pool of processes
+# parsed fields are cached (in a json file at cache_path, if given) against each file's size and modification time,
+# so only new or changed files are parsed on later runs
+# returns a list of metadata objects (see metadata_from_fields), in the same order as pb_paths
+def load_font_metadata(pb_paths, n_workers=None, cache_path=None):
+    cache = {}
+    if cache_path is not None and op.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+
+    stats = {pb_path: os.stat(pb_path) for pb_path in pb_paths}
+    cache_keys = {pb_path: [st.st_size, st.st_mtime_ns] for pb_path, st in stats.items()}
+    fields = {pb_path: cache[pb_path]['fields'] for pb_path in pb_paths if pb_path in cache and cache[pb_path]['key'] == cache_keys[pb_path]}
+    to_parse = [pb_path for pb_path in pb_paths if pb_path not in fields]
+
+    if len(to_parse) > 0:
+        if n_workers == 1 or len(to_parse) < 64:  # not worth starting a pool for a few files
+            parsed = [get_metadata_fields(pb_path) for pb_path in tqdm(to_parse, desc='Reading font metadata')]
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                parsed = list(tqdm(executor.map(get_metadata_fields, to_parse, chunksize=32), total=len(to_parse), desc='Reading font metadata'))
+        fields.update(zip(to_parse, parsed))
+
+        if cache_path is not None:
+            cache = {pb_path: {'key': cache_keys[pb_path], 'fields': fields[pb_path]} for pb_path in pb_paths}
+            __instrument__.save_json_atomic(cache, cache_path)
+
+    return [metadata_from_fields(fields[pb_path]) for pb_path in pb_paths]
+
 # function to extract from the metadata file which .ttf, if any, is regular latin
+# (pb_metadata can be the parsed metadata, or anything with the same attributes, e.g., from load_font_metadata)
 def get_regular_ttf(pb_metadata):
     # check supports latin text; return None if not
     subset_dat = pb_metadata.subsets
@@ -58,59 +139,200 @@ def font_succeeds(char_list, font='arial.ttf', font_size=50, canvas_dims=(100, 1
     # else:
     #     variation = None
 
+    import generate_images
+
+    # all characters are rasterised into one glyph atlas, positioned as if drawn at the centre of the canvas, and then checked one
+    # at a time, stopping at the first failure
+    # identical characters are detected by hashing each character's inked pixels and their position, rather than sorting full canvases
     try:
-        x = [generate_images.render_text_im(char, font_file=font, font_size=font_size, canvas_dims=canvas_dims, variation='Regular', rotation=0.0, x=canvas_dims[0]/2, y=canvas_dims[1]/2) for char in char_list]
-
-        x_arrs = [np.array(x_i) for x_i in x]
-
-        # N unique arrays
-        x_3d = np.array(x_arrs)
-        _, unique_counts = np.unique(x_3d, axis=0, return_counts=True)
-        if np.max(unique_counts) > max_identical:
-            return False
-
-        # does it produce real values?
-        if not all([np.all(np.isreal(x_i)) for x_i in x_arrs]):
-            return False
-        
-        # do all arrays sum to >0?
-        if not np.all(np.any(x_3d>0, axis=(1,2))):
-            return False
-        
+        origin = (canvas_dims[0]/2, canvas_dims[1]/2)
+        atlas = generate_images.build_glyph_atlas(font, char_list, font_size=font_size, variation='Regular', origin=origin)
+        hash_counts = {}
+        for i in range(len(char_list)):
+            # does the character stay within the canvas?
+            box = atlas.boxes[i]
+            generate_images.check_canvas_bounds((box[0]+origin[0], box[1]+origin[1], box[2]+origin[0], box[3]+origin[1]), rotation=0.0, canvas_dims=canvas_dims)
+
+            # does the character have any pixels >0?
+            glyph_ink = atlas.get_ink(i)
+            if glyph_ink is None:
+                return False
+
+            # no more than max_identical identical characters
+            ink, ink_pos = glyph_ink
+            x_hash = hashlib.blake2b(repr((ink_pos, ink.shape)).encode() + ink.tobytes(), digest_size=16).digest()
+            hash_counts[x_hash] = hash_counts.get(x_hash, 0) + 1
+            if hash_counts[x_hash] > max_identical:
+                return False
+
         return True
+    except FontTimeoutError:
+        raise  # a timeout isn't a verdict on the font (see validate_fonts)
     except:
-        # if it fails to draw or be manipulated as a numpy array
-        # (includes exceeding canvas dimensions in render_text_im)
+        # if it fails to draw
+        # (includes exceeding canvas dimensions)
         return False
 
+class FontTimeoutError(Exception):
+    pass
+
+def raise_font_timeout(signum, frame):
+    raise FontTimeoutError('Timed out testing font')
+
+# function to run font_succeeds, treating any font that takes longer than timeout seconds as failing
+# (the timeout uses SIGALRM, so is only applied on platforms that have it, and only interrupts python code - a hang inside FreeType or
+# raqm can't be interrupted this way, so validate_fonts also enforces the timeout from the parent process)
+def font_succeeds_with_timeout(font, timeout=None, **kwargs):
+    use_alarm = timeout is not None and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, raise_font_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return font_succeeds(font=font, **kwargs)  # raises FontTimeoutError on a timeout
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+# function to stop a process pool straight away, killing its workers (e.g., one stuck in native code, which would otherwise block the
+# pool, and its shutdown, forever)
+def terminate_pool(executor):
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+# function to test a list of fonts with font_succeeds in a pool of processes
+# returns a dict of font path: whether the font succeeded
+# if a timings dict is given, the time taken to test each font (in seconds) is added to it
+# fonts that time out, or crash their worker (even when retried), count as failing, but aren't a verdict on the font (e.g., a busy machine
+# can cause a timeout), so if an inconclusive list is given, they are also added to it
+# the timeout is enforced by the parent process: only one font per worker is in flight at a time, so each font's deadline counts from
+# when it starts, and if any font runs past its deadline, the pool is terminated and replaced, and that font fails (fonts that were
+# running alongside it are tested again in the new pool)
+# fonts caught up in a crashed worker are retried one at a time, each in its own process, so a crashing font only takes itself down
+# with n_workers=1 and no timeout, fonts are tested in this process
+def validate_fonts(fonts, n_workers=None, timeout=30, desc='Testing fonts on characters', timings=None, inconclusive=None, **kwargs):
+    fonts = list(dict.fromkeys(fonts))  # unique, in order
+    results = {}
+    timings = {} if timings is None else timings
+    inconclusive = [] if inconclusive is None else inconclusive
+
+    if n_workers == 1 and timeout is None:
+        for font in tqdm(fonts, desc=desc):
+            results[font], timings[font] = __instrument__.timed_call(font_succeeds_with_timeout, font=font, timeout=timeout, **kwargs)
+        return results
+
+    n_workers = n_workers or os.cpu_count() or 1
+    queue = deque(fonts)
+    crashed = []
+    running = {}  # future: (font, start time)
+    executor = ProcessPoolExecutor(max_workers=n_workers)
+    progress = tqdm(total=len(fonts), desc=desc)
+    try:
+        while len(queue) > 0 or len(running) > 0:
+            while len(queue) > 0 and len(running) < n_workers:
+                font = queue.popleft()
+                running[executor.submit(__instrument__.timed_call, font_succeeds_with_timeout, font=font, timeout=timeout, **kwargs)] = (font, time.monotonic())
+
+            wait_s = None if timeout is None else max(0.0, min(t0 for _, t0 in running.values()) + timeout - time.monotonic())
+            finished, _ = wait(running, timeout=wait_s, return_when=FIRST_COMPLETED)
+            broken = False
+            for fut in finished:
+                font, _ = running.pop(fut)
+                try:
+                    results[font], timings[font] = fut.result()
+                except BrokenProcessPool:
+                    crashed.append(font)  # a worker died (e.g., segfault) while this font was running
+                    broken = True
+                    continue
+                except Exception:
+                    results[font] = False  # e.g., timed out (FontTimeoutError)
+                    inconclusive.append(font)
+                progress.update()
+
+            now = time.monotonic()
+            overdue = [fut for fut, (_, t0) in running.items() if timeout is not None and now - t0 >= timeout]
+            if broken or len(overdue) > 0:
+                for fut in overdue:
+                    font, t0 = running.pop(fut)
+                    results[font], timings[font] = False, now - t0
+                    inconclusive.append(font)
+                    progress.update()
+                if broken:
+                    crashed += [font for font, _ in running.values()]  # the rest of the broken pool's fonts go to the retries
+                else:
+                    queue.extendleft(reversed([font for font, _ in running.values()]))  # innocent bystanders are tested again
+                running = {}
+                terminate_pool(executor)
+                executor = ProcessPoolExecutor(max_workers=n_workers)
+    finally:
+        terminate_pool(executor)
+        progress.close()
+
+    # retry fonts caught up in a crashed pool one at a time, each in its own process, so a crashing font only takes itself down
+    for font in tqdm(crashed, desc='Retrying fonts from crashed workers', disable=len(crashed)==0):
+        executor = ProcessPoolExecutor(max_workers=1)
+        t0 = time.monotonic()
+        try:
+            results[font], timings[font] = executor.submit(__instrument__.timed_call, font_succeeds_with_timeout, font=font, timeout=timeout, **kwargs).result(timeout=timeout)
+        except Exception:
+            results[font], timings[font] = False, time.monotonic() - t0  # crashed again, or timed out
+            inconclusive.append(font)
+        finally:
+            terminate_pool(executor)
+
+    return results
+
+# function to get the key that a font's validation result is cached under
+# this covers the content of the font file, all settings that can change the result of font_succeeds, and the version of the validation logic
+# returns None if the font file can't be read (it will just fail validation, which isn't worth caching)
+def get_validation_key(font, char_list, font_size, canvas_dims, max_identical):
+    try:
+        with open(font, 'rb') as f:
+            font_hash = hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+    settings = json.dumps({'char_list': list(char_list), 'font_size': font_size, 'canvas_dims': [int(d) for d in canvas_dims], 'max_identical': max_identical,
+                           'validation_version': validation_version})
+    settings_hash = hashlib.sha256(settings.encode('utf-8')).hexdigest()
+    return f'{font_hash}-{settings_hash}'
+
+# functions to read and write the on-disk cache of font validation results (a json dict of key: result)
+def load_validation_cache(cache_path):
+    if cache_path is None or not op.exists(cache_path):
+        return {}
+    with open(cache_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
 # function to get a dataframe with all font info for all suitable fonts
-def get_google_font_df(char_list, font_size, max_dims=(np.inf, np.inf), max_identical=3, max_canvas_size_factor=3, location='', exclude_ttfs=[]):
-    # get list of all ttfs and infer from that the directories that contain fonts
-    ttf_files = glob.glob(op.join(location, 'google-fonts', '*', '*', '*.ttf'))
-    font_df = pd.DataFrame({'font_dir': list(set([op.dirname(x) for x in ttf_files]))})
+def get_google_font_df(char_list, font_size, max_dims=(np.inf, np.inf), max_identical=3, max_canvas_size_factor=3, location='', exclude_ttfs=[], n_workers=None, timeout=30, cache_path=None, revalidate=False, report=None, metadata_cache_path=None):
+    import pandas as pd
+    report = __instrument__.RunReport() if report is None else report
 
-    # get path of .pb metadata, and remove from dataframe if none is present
-    font_df.loc[:, 'n_metadatas'] = font_df.apply(lambda r: len(glob.glob(op.join(r.font_dir, '*.pb'))), axis=1)  # count number of metadata files
-    font_df = font_df.loc[font_df['n_metadatas']==1, :]  # remove entries with 0 or >1 metadata files
-    font_df.loc[:, 'metadata_path'] = font_df.apply(lambda r: glob.glob(op.join(r.font_dir, '*.pb'))[0], axis=1)  # take first entry
+    with report.stage('scan_font_metadata'):
+        # find the directories that contain fonts, and remove any with 0 or >1 metadata files
+        font_dirs = scan_font_dirs(location)
+        font_df = pd.DataFrame({'font_dir': list(font_dirs.keys()), 'n_metadatas': [len(pbs) for pbs in font_dirs.values()]})
+        font_df = font_df.loc[font_df['n_metadatas']==1, :]
+        font_df.loc[:, 'metadata_path'] = [font_dirs[d][0] for d in font_df.font_dir]
 
-    # get the metadata
-    metadata = [get_pb_metadata(r.metadata_path) for _, r in font_df.iterrows()]
+        # get the metadata
+        metadata = load_font_metadata(font_df.metadata_path.tolist(), n_workers=n_workers, cache_path=metadata_cache_path)
 
-    # get the family name
-    font_df.loc[:, 'family'] = [m.name for m in metadata]
+        # get the family name
+        font_df.loc[:, 'family'] = [m.name for m in metadata]
 
-    # get the category
-    font_df.loc[:, 'category'] = [m.category for m in metadata]
+        # get the category
+        font_df.loc[:, 'category'] = pd.Series([m.category for m in metadata], index=font_df.index, dtype=object)
 
-    # get the regular ttf file
-    font_df.loc[:, 'ttf'] = [get_regular_ttf(m) for m in metadata]
+        # get the regular ttf file
+        font_df.loc[:, 'ttf'] = [get_regular_ttf(m) for m in metadata]
 
-    # remove entries with no regular ttf file
-    font_df = font_df.loc[font_df['ttf'].notnull()]
+        # remove entries with no regular ttf file
+        font_df = font_df.loc[font_df['ttf'].notnull()]
 
-    # get the full path of the ttf file
-    font_df.loc[:, 'ttf_path'] = font_df.apply(lambda r: op.join(r.font_dir, r.ttf), axis=1)
+        # get the full path of the ttf file
+        font_df.loc[:, 'ttf_path'] = [op.join(d, ttf) for d, ttf in zip(font_df.font_dir, font_df.ttf)]
+    report.count('font_dirs_with_regular_ttf', len(font_df))
 
     # any font paths containing these strings will be excluded before being tested
     # NOTE: we keep variable fonts, assuming that they are handled by the request to draw the "Regular" variant
@@ -128,8 +350,37 @@ def get_google_font_df(char_list, font_size, max_dims=(np.inf, np.inf), max_iden
     
     # test fonts and remove any that fail to produce any of the characters, or produce identical characters in any cases
     canvas_dims = [int(round(font_size*max_canvas_size_factor))] * 2
-    tqdm.pandas(desc='Testing fonts on characters')
-    font_df['font_okay'] = font_df.progress_apply(lambda r: font_succeeds(char_list=char_list, font_size=font_size, canvas_dims=canvas_dims, font=r.ttf_path, max_dims=max_dims, max_identical=max_identical), axis=1)
+    # results from previous runs are reused for any font file and settings that have already been tested (unless revalidating)
+    # (keys are only worked out when there's a cache, and fonts whose files can't be read have no key, so are always tested, and fail)
+    validation_cache = load_validation_cache(cache_path)
+    validation_keys = {} if cache_path is None else {
+        font: get_validation_key(font, char_list=char_list, font_size=font_size, canvas_dims=canvas_dims, max_identical=max_identical)
+        for font in font_df.ttf_path}
+    font_results = {} if revalidate else {font: validation_cache[key] for font, key in validation_keys.items() if key in validation_cache}
+    fonts_to_test = [font for font in dict.fromkeys(font_df.ttf_path) if font not in font_results]
+    print(f'Font validation cache: {len(font_results)} hits, {len(fonts_to_test)} misses')
+    report.count('validation_cache_hits', len(font_results))
+    report.count('validation_cache_misses', len(fonts_to_test))
+
+    timings = {}
+    inconclusive = []
+    with report.stage('validate_fonts'):
+        new_results = validate_fonts(fonts_to_test, n_workers=n_workers, timeout=timeout, timings=timings, inconclusive=inconclusive, char_list=char_list,
+                                     font_size=font_size, canvas_dims=canvas_dims, max_dims=max_dims, max_identical=max_identical)
+    font_results.update(new_results)
+    for font, seconds in timings.items():
+        report.add_font_time('validate', font, seconds)
+    report.count('fonts_tested', len(new_results))
+    report.count('fonts_failed', sum(not r for r in new_results.values()))
+    report.count('fonts_inconclusive', len(inconclusive))
+
+    # only real verdicts are cached, so fonts that timed out or crashed are tested again next time
+    if cache_path is not None:
+        validation_cache.update({validation_keys[font]: result for font, result in new_results.items()
+                                 if font not in inconclusive and validation_keys[font] is not None})
+        __instrument__.save_json_atomic(validation_cache, cache_path)
+
+    font_df['font_okay'] = font_df.ttf_path.map(font_results).astype(bool)
 
     font_df = font_df.loc[font_df['font_okay'], :]
 
@@ -0,0 +1,106 @@
+from contextlib import contextmanager
+from pathlib import Path
+import cProfile
+import pstats
+import platform
+import time
+import json
+import os
+
+# collects timings and counters over a run of the pipeline, to be saved as a structured (json) report
+# stages are timed as wall time, counters are totals (e.g., fonts loaded, bytes written), and font times are the time spent on
+# each font within a stage, so the slowest fonts can be found
+class RunReport:
+    def __init__(self):
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.stages = {}
+        self.counters = {}
+        self.font_times = {}
+
+    # context manager to time a stage (times for stages with the same name are summed)
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t0
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_font_time(self, stage, font, seconds, n=1):
+        stage_times = self.font_times.setdefault(stage, {})
+        font_seconds, font_n = stage_times.get(font, (0.0, 0))
+        stage_times[font] = (font_seconds + seconds, font_n + n)
+
+    # adds the timings and counters from another report (e.g., from a stage run in a worker process)
+    def merge(self, other):
+        for name, seconds in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, n in other.counters.items():
+            self.count(name, n)
+        for stage, stage_times in other.font_times.items():
+            for font, (seconds, n) in stage_times.items():
+                self.add_font_time(stage, font, seconds, n=n)
+
+    # returns a list of dicts (font, seconds, n), slowest first
+    def get_slowest_fonts(self, stage, k=10):
+        stage_times = self.font_times.get(stage, {})
+        slowest = sorted(stage_times.items(), key=lambda x: x[1][0], reverse=True)[:k]
+        return [{'font': font, 'seconds': seconds, 'n': n} for font, (seconds, n) in slowest]
+
+    def to_dict(self, k=10):
+        rates = {}
+        if self.counters.get('images_written', 0) > 0 and self.stages.get('generate_images', 0) > 0:
+            rates['images_per_s'] = self.counters['images_written'] / self.stages['generate_images']
+        if self.counters.get('fonts_tested', 0) > 0 and self.stages.get('validate_fonts', 0) > 0:
+            rates['fonts_tested_per_s'] = self.counters['fonts_tested'] / self.stages['validate_fonts']
+        return {'meta': {'started': self.started, 'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+                'stages': self.stages, 'counters': self.counters, 'rates': rates,
+                'slowest_fonts': {stage: self.get_slowest_fonts(stage, k=k) for stage in self.font_times}}
+
+    def save(self, path, k=10):
+        save_json_atomic(self.to_dict(k=k), path, indent=2)
+
+    def print_summary(self, k=5):
+        report = self.to_dict(k=k)
+        print('Run report:')
+        for name, seconds in report['stages'].items():
+            print(f'  {name}: {seconds:.1f} s')
+        for name, n in {**report['counters'], **report['rates']}.items():
+            print(f'  {name}: {n:.1f}' if isinstance(n, float) else f'  {name}: {n}')
+        for stage, slowest in report['slowest_fonts'].items():
+            print(f'  slowest fonts in {stage}:')
+            for s in slowest:
+                print(f'    {s["font"]}: {s["seconds"]:.2f} s ({s["n"]})')
+
+# function to save obj as json to path (making its directory if needed), keyword arguments being passed to json.dump
+# it's written to a temporary file and then renamed, so an interrupted write can't leave a cache or state file partly written
+def save_json_atomic(obj, path, **kwargs):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, **kwargs)
+    os.replace(tmp_path, path)
+
+# function to call fn, returning its result and how long it took (in seconds)
+# (defined at the top level, so it can be sent to worker processes)
+def timed_call(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+# function to call fn under cProfile, printing the top n_lines functions by cumulative time, and saving the stats to out_path
+# (for snakeviz etc.) if given
+def profile_call(fn, *args, out_path=None, n_lines=30, **kwargs):
+    profiler = cProfile.Profile()
+    result = profiler.runcall(fn, *args, **kwargs)
+    stats = pstats.Stats(profiler).sort_stats('cumulative')
+    stats.print_stats(n_lines)
+    if out_path is not None:
+        Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+        stats.dump_stats(out_path)
+        print(f'Saved profile to {out_path}')
+    return result
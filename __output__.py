@@ -0,0 +1,402 @@
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from io import BytesIO
+import shutil
+import json
+import time
+import os
+
+# zlib strategies that can be used to compress pngs (see PNGWriter)
+# 'default' leaves the choice to Pillow (which filters png rows, and matches 'filtered' in size), and gives the same files as a plain Image.save
+png_compress_types = {'default': -1, 'filtered': 1, 'huffman': 2, 'rle': 3, 'fixed': 4}
+
+# function to get the directory that png images of a letter are saved to
+def get_letter_dir(ims_path, letter):
+    case_lab = 'lwr' if letter.islower() else 'upr'
+    return ims_path / Path(f'{letter}_{case_lab}')
+
+# function to get the png file name for a sample, which encodes its parameters
+def get_png_name(font_file, x, y, size, rotation):
+    return f'font-{Path(font_file).stem.replace(".", "-")}_x{x}_y{y}_sz{size}_rot{rotation}'.replace('.', 'p') + '.png'
+
+# function to get the name (without extension) of an output shard's files
+def get_shard_name(shard_i):
+    return f'shard-{shard_i:05d}'
+
+# function to get the name (without extension) of a chunk of the sample parameters saved with pngs (see PNGWriter)
+def get_params_name(part_i):
+    return f'params-{part_i:05d}'
+
+# function to get the directory that one job shard of a sharded run writes to (see generate_images.main), before merging
+def get_part_dir(ims_path, shard, num_shards):
+    return Path(ims_path) / f'part-{shard:05d}-of-{num_shards:05d}'
+
+# function to find the job shard part directories (see get_part_dir) in ims_path
+def get_part_dirs(ims_path):
+    return sorted(p for p in Path(ims_path).glob('part-*-of-*') if p.is_dir())
+
+# the manifest records which samples of each (letter, font) work unit have been written to disk, as json lines that are only
+# appended once the corresponding files are complete, so that an interrupted run can be resumed
+class Manifest:
+    def __init__(self, ims_path):
+        self.path = Path(ims_path) / 'manifest.jsonl'
+        self.checked_end = False
+
+    def read(self):
+        if not self.path.exists():
+            return []
+        records = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass  # e.g., a line that was only partly written when the run was interrupted
+        return records
+
+    # returns a dict of (letter, font): number of samples written
+    def get_written(self):
+        written = {}
+        for r in self.read():
+            written[(r['letter'], r['font'])] = written.get((r['letter'], r['font']), 0) + r['n']
+        return written
+
+    # cuts off a partly written last line (from an interrupted run), so the next record starts on a line of its own, rather than being
+    # appended to the partial line (which read would then skip, along with the new record)
+    def drop_partial_line(self, chunk_size=4096):
+        if not self.path.exists():
+            return
+        with open(self.path, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(0, pos - chunk_size)
+                f.seek(start)
+                chunk = f.read(pos - start)
+                if pos == end and chunk.endswith(b'\n'):
+                    return  # complete
+                newline = chunk.rfind(b'\n')
+                if newline >= 0:
+                    f.truncate(start + newline + 1)
+                    return
+                pos = start
+            f.truncate(0)
+
+    # records is a list of dicts, each with letter, font, and n (the number of samples written), plus any other info
+    def record(self, records):
+        if not self.checked_end:
+            self.drop_partial_line()
+            self.checked_end = True
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for r in records:
+                f.write(json.dumps(r) + '\n')
+
+# function to set up the output directory, resuming from a previous run if its settings match
+# returns the manifest, which says what was already written
+# the job shards of a sharded run write to part directories inside ims_path until they are merged, so a directory with any unmerged
+# parts is never removed (or resumed into), as that would throw away (or duplicate) the parts' images
+def prepare_output_dir(ims_path, settings, overwrite=False):
+    ims_path = Path(ims_path)
+    settings = json.loads(json.dumps(settings))  # as it will be read back from file (e.g., tuples as lists)
+    settings_path = ims_path / 'settings.json'
+
+    part_paths = get_part_dirs(ims_path)
+    if len(part_paths) > 0:
+        num_shards = int(part_paths[0].name.split('-')[-1])
+        raise ValueError(f'{ims_path} contains the output of job shards that haven\'t been merged ({", ".join(p.name for p in part_paths)}) - '
+                         f'merge them first (--merge --num-shards {num_shards}, with the same settings), or remove them to start again')
+
+    if ims_path.exists() and (overwrite or not settings_path.exists()):
+        print('Removing existing ims directory...')
+        shutil.rmtree(ims_path)
+
+    if settings_path.exists():
+        with open(settings_path, 'r', encoding='utf-8') as f:
+            old_settings = json.load(f)
+        if old_settings != settings:
+            raise ValueError(f'Existing images in {ims_path} were generated with different settings ({old_settings}) - use overwrite=True (--overwrite) to start again')
+        print(f'Resuming from existing images in {ims_path}')
+    else:
+        ims_path.mkdir(parents=True)
+        with open(settings_path, 'w', encoding='utf-8') as f:
+            json.dump(settings, f, indent=2)
+
+    return Manifest(ims_path)
+
+# function to encode an image as a png and save it, returning the number of bytes written, and the time spent encoding and writing
+def save_png(im, save_path, compress_level=6, compress_type=-1):
+    t0 = time.perf_counter()
+    buffer = BytesIO()
+    Image.fromarray(im).save(buffer, format='PNG', compress_level=compress_level, compress_type=compress_type)
+    t1 = time.perf_counter()
+    with open(save_path, 'wb') as f:
+        f.write(buffer.getbuffer())
+    return buffer.tell(), t1 - t0, time.perf_counter() - t1
+
+# writes every sample as a separate png, in a directory per letter
+# pngs are encoded and saved by a pool of n_threads background threads (zlib and file writes release the GIL), so rendering carries
+# on while earlier images are written
+# at most max_pending images are queued at once
+# the parameters of saved samples are also written to parquet tables of about index_chunk_size rows (params-XXXXX.parquet), for the index
+# (see write_index), and a work unit is only recorded in the manifest once all of its files and its parameters are saved
+# compress_level (0-9) trades file size for encoding time, and compress_type is the zlib strategy (see png_compress_types; 'rle'
+# suits images that are mostly background)
+class PNGWriter:
+    def __init__(self, ims_path, letters, manifest=None, compress_level=6, compress_type='default', n_threads=4, max_pending=256,
+                 index_chunk_size=4096):
+        self.ims_path = Path(ims_path)
+        self.manifest = manifest
+        self.compress_level = compress_level
+        self.compress_type = png_compress_types[compress_type]
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=n_threads) if n_threads > 0 else None
+        self.pending = deque()  # (futures, params, manifest record) for each work unit, in the order written
+        self.n_pending = 0  # number of images queued or being saved
+        self.index_chunk_size = index_chunk_size
+        self.saved_params = []  # parameters of saved units that haven't been written to a params table yet, with their manifest records
+        self.saved_records = []
+        self.n_saved = 0
+        self.bytes_written = 0
+        self.encode_seconds = 0.0
+        self.io_seconds = 0.0
+        for L in letters:
+            get_letter_dir(self.ims_path, L).mkdir(parents=True, exist_ok=True)
+
+        # when resuming, carry on after the last params table that was completed
+        written_parts = [r['params_part'] for r in manifest.read() if 'params_part' in r] if manifest is not None else []
+        self.params_part_i = max(written_parts) + 1 if len(written_parts) > 0 else 0
+
+    # params is a dataframe with a row per sample (from a single work unit), and ims is an array of shape N * height * width
+    def write(self, params, ims):
+        save_args = [(im, get_letter_dir(self.ims_path, p.letter) / get_png_name(p.font, p.x, p.y, p.size, p.rotation), self.compress_level, self.compress_type)
+                     for p, im in zip(params.itertuples(), ims)]
+        record = {'letter': params.letter.iloc[0], 'font': params.font.iloc[0], 'n': len(params)} if len(params) > 0 else None
+
+        if self.executor is None:
+            self.finish_unit([save_png(*args) for args in save_args], params, record)
+            return None
+
+        self.pending.append(([self.executor.submit(save_png, *args) for args in save_args], params, record))
+        self.n_pending += len(save_args)
+        while self.n_pending > self.max_pending:
+            self.wait_oldest()
+
+    # function to wait for the oldest queued work unit to be saved, and record it
+    def wait_oldest(self):
+        futures, params, record = self.pending.popleft()
+        self.n_pending -= len(futures)
+        self.finish_unit([fut.result() for fut in futures], params, record)  # re-raises any error from saving
+
+    def finish_unit(self, results, params, record):
+        for n_bytes, encode_seconds, io_seconds in results:
+            self.bytes_written += n_bytes
+            self.encode_seconds += encode_seconds
+            self.io_seconds += io_seconds
+        if record is not None:
+            self.saved_params.append(params)
+            self.saved_records.append(record)
+            self.n_saved += len(params)
+            if self.n_saved >= self.index_chunk_size:
+                self.flush_params()
+
+    # function to write the parameters of the saved units to a params table, and record the units in the manifest
+    def flush_params(self):
+        import pandas as pd
+        if len(self.saved_records) == 0:
+            return None
+        pd.concat(self.saved_params, ignore_index=True).to_parquet(self.ims_path / f'{get_params_name(self.params_part_i)}.parquet', index=False)
+        if self.manifest is not None:
+            self.manifest.record([{**r, 'params_part': self.params_part_i} for r in self.saved_records])
+        self.saved_params = []
+        self.saved_records = []
+        self.n_saved = 0
+        self.params_part_i += 1
+
+    def close(self):
+        while self.pending:
+            self.wait_oldest()
+        self.flush_params()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+# writes samples to fixed-size shards, each holding a uint8 array of images (shard-XXXXX.npy, shape N * height * width)
+# and a parquet table of the corresponding parameters (shard-XXXXX.parquet, one row per image)
+class ShardWriter:
+    def __init__(self, ims_path, canvas_dims, shard_size=4096, manifest=None):
+        self.ims_path = Path(ims_path)
+        self.ims_path.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self.manifest = manifest
+        self.bytes_written = 0
+        self.encode_seconds = 0.0  # images are saved as raw arrays, so aren't encoded
+        self.io_seconds = 0.0
+        self.ims = np.zeros((shard_size, canvas_dims[1], canvas_dims[0]), dtype=np.uint8)
+        self.params = []
+        self.n = 0  # number of samples in the current shard
+
+        # when resuming, carry on after the last shard that was completed
+        # (a shard that was being saved when a run was interrupted isn't in the manifest, so is overwritten)
+        written_shards = [r['shard'] for r in manifest.read()] if manifest is not None else []
+        self.shard_i = max(written_shards) + 1 if len(written_shards) > 0 else 0
+
+    def write(self, params, ims):
+        # samples from one call can be split across shards, so that all but the last shard are exactly shard_size
+        start = 0
+        while start < len(ims):
+            n_take = min(self.shard_size - self.n, len(ims) - start)
+            self.ims[self.n:self.n+n_take] = ims[start:start+n_take]
+            self.params.append(params.iloc[start:start+n_take])
+            self.n += n_take
+            start += n_take
+            if self.n == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        import pandas as pd
+        if self.n == 0:
+            return None
+        t0 = time.perf_counter()
+        shard_name = get_shard_name(self.shard_i)
+        params = pd.concat(self.params, ignore_index=True)
+        np.save(self.ims_path / f'{shard_name}.npy', self.ims[:self.n])
+        params.to_parquet(self.ims_path / f'{shard_name}.parquet', index=False)
+        self.io_seconds += time.perf_counter() - t0
+        self.bytes_written += (self.ims_path / f'{shard_name}.npy').stat().st_size + (self.ims_path / f'{shard_name}.parquet').stat().st_size
+        if self.manifest is not None:
+            unit_counts = params.groupby(['letter', 'font'], sort=False).size()
+            self.manifest.record([{'letter': L, 'font': F, 'n': int(n), 'shard': self.shard_i} for (L, F), n in unit_counts.items()])
+        self.params = []
+        self.n = 0
+        self.shard_i += 1
+
+    def close(self):
+        self.flush()
+
+# function to merge the output directories of the job shards of a sharded run (part_paths, in order) into ims_path, as one dataset
+# with one settings file and manifest, as though it had been generated in a single run
+# pngs are moved into the letter directories, and output shards are moved and renumbered to follow on from any already in ims_path
+# each part's directory is removed once it has been merged, so merging can be repeated as more parts finish
+def merge_parts(ims_path, part_paths, settings):
+    ims_path = Path(ims_path)
+    settings = json.loads(json.dumps(settings))  # as it will be read back from file (e.g., tuples as lists)
+
+    for part_path in part_paths:
+        with open(Path(part_path) / 'settings.json', 'r', encoding='utf-8') as f:
+            part_settings = {k: v for k, v in json.load(f).items() if k not in ('shard', 'num_shards')}
+        if part_settings != settings:
+            raise ValueError(f'Images in {part_path} were generated with different settings ({part_settings}) than those being merged ({settings})')
+
+    settings_path = ims_path / 'settings.json'
+    if settings_path.exists():
+        with open(settings_path, 'r', encoding='utf-8') as f:
+            old_settings = json.load(f)
+        if old_settings != settings:
+            raise ValueError(f'Existing images in {ims_path} were generated with different settings ({old_settings}) than those being merged ({settings})')
+    else:
+        ims_path.mkdir(parents=True, exist_ok=True)
+        with open(settings_path, 'w', encoding='utf-8') as f:
+            json.dump(settings, f, indent=2)
+
+    manifest = Manifest(ims_path)
+    merged_records = manifest.read()
+    merged_shards = [r['shard'] for r in merged_records if 'shard' in r]
+    next_shard_i = max(merged_shards) + 1 if len(merged_shards) > 0 else 0
+    merged_params_parts = [r['params_part'] for r in merged_records if 'params_part' in r]
+    next_params_part_i = max(merged_params_parts) + 1 if len(merged_params_parts) > 0 else 0
+
+    for part_path in part_paths:
+        part_path = Path(part_path)
+        records = Manifest(part_path).read()
+
+        if settings['output_format'] == 'shards':
+            new_shard_i = {old: next_shard_i + i for i, old in enumerate(sorted({r['shard'] for r in records}))}
+            for old, new in new_shard_i.items():
+                for suffix in ('.npy', '.parquet'):
+                    os.replace(part_path / f'{get_shard_name(old)}{suffix}', ims_path / f'{get_shard_name(new)}{suffix}')
+            records = [{**r, 'shard': new_shard_i[r['shard']]} for r in records]
+            next_shard_i += len(new_shard_i)
+        else:
+            for letter_dir in part_path.iterdir():
+                if not letter_dir.is_dir():
+                    continue
+                (ims_path / letter_dir.name).mkdir(exist_ok=True)
+                for f in letter_dir.iterdir():
+                    os.replace(f, ims_path / letter_dir.name / f.name)
+            new_part_i = {old: next_params_part_i + i for i, old in enumerate(sorted({r['params_part'] for r in records if 'params_part' in r}))}
+            for old, new in new_part_i.items():
+                os.replace(part_path / f'{get_params_name(old)}.parquet', ims_path / f'{get_params_name(new)}.parquet')
+            records = [{**r, 'params_part': new_part_i[r['params_part']]} if 'params_part' in r else r for r in records]
+            next_params_part_i += len(new_part_i)
+
+        manifest.record(records)
+        shutil.rmtree(part_path)
+
+    return manifest
+
+# function to write the index of a dataset (index.parquet), with a row for every sample that has been saved
+# each row has the sample's parameters, where its image is (path, relative to ims_path, for pngs, or shard and shard_row for output
+# shards), and the info on its font from font_df (e.g., family, category, and usage stats), joined on the font's path (ttf_path)
+# this is built from the tables of parameters that are saved with the images, so doesn't need to read any images
+def write_index(ims_path, output_format='png', font_df=None):
+    import pandas as pd
+    ims_path = Path(ims_path)
+    records = Manifest(ims_path).read()
+    part_key, get_part_name = ('shard', get_shard_name) if output_format == 'shards' else ('params_part', get_params_name)
+
+    tables = []
+    for part_i in sorted({r[part_key] for r in records if part_key in r}):
+        table = pd.read_parquet(ims_path / f'{get_part_name(part_i)}.parquet')
+        if output_format == 'shards':
+            table['shard'] = part_i
+            table['shard_row'] = np.arange(len(table))
+        tables.append(table)
+    index = pd.concat(tables, ignore_index=True) if len(tables) > 0 else pd.DataFrame(columns=['letter', 'font', 'sample', 'x', 'y', 'size', 'rotation'])
+
+    if output_format == 'png':
+        index['path'] = [str(get_letter_dir(Path(), p.letter) / get_png_name(p.font, p.x, p.y, p.size, p.rotation)) for p in index.itertuples()]
+
+    if font_df is not None:
+        index = pd.merge(index, font_df, how='left', left_on='font', right_on='ttf_path').drop(columns=['ttf_path'])
+
+    index.to_parquet(ims_path / 'index.parquet', index=False)
+    return index
+
+# function to load the index of a dataset (see write_index), optionally only some columns
+# filters are applied while reading, so only matching rows are loaded, e.g., [('category', '==', 'SERIF'), ('rotation', '>', 10)]
+# (see pandas.read_parquet)
+def load_index(ims_path, columns=None, filters=None):
+    import pandas as pd
+    return pd.read_parquet(Path(ims_path) / 'index.parquet', columns=columns, filters=filters)
+
+# function to select samples from the index of a dataset with a pandas query string, e.g., "category == 'SERIF' and rotation > 10"
+def query_index(ims_path, expr):
+    return load_index(ims_path).query(expr)
+
+# function to load the images for some rows of the index, as an array of shape N * height * width (in the same order as the rows)
+def load_index_images(ims_path, index_rows):
+    ims_path = Path(ims_path)
+    if len(index_rows) == 0:
+        return np.zeros((0, 0, 0), dtype=np.uint8)
+    if 'path' in index_rows.columns:
+        return np.stack([np.asarray(Image.open(ims_path / p)) for p in index_rows.path])
+    shards = index_rows.shard.to_numpy()
+    shard_rows = index_rows.shard_row.to_numpy()
+    ims = []
+    for shard_i in np.unique(shards):
+        is_shard = shards == shard_i
+        shard_ims = np.load(ims_path / f'{get_shard_name(shard_i)}.npy', mmap_mode='r')  # only the selected rows are read from disk
+        ims.append((np.flatnonzero(is_shard), shard_ims[shard_rows[is_shard]]))
+    order = np.argsort(np.concatenate([i for i, _ in ims]))
+    return np.concatenate([im for _, im in ims])[order]
+
+# function to open a shard written by ShardWriter
+# the images are memory-mapped, so slicing a block of samples reads only that block from disk
+def open_shard(shard_path):
+    import pandas as pd
+    shard_path = Path(shard_path)
+    ims = np.load(shard_path.with_suffix('.npy'), mmap_mode='r')
+    params = pd.read_parquet(shard_path.with_suffix('.parquet'))
+    return ims, params
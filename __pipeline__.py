@@ -0,0 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from graphlib import TopologicalSorter
+from pathlib import Path
+import __instrument__
+import hashlib
+import json
+import time
+
+# a stage of the pipeline, which makes its output files from its input files, after the stages it depends on (deps) have run
+# fn is called as fn(report=report, **params, **options), in a worker process (so it must be defined at the top level of a module)
+# params (json-serialisable) are part of what the outputs are made from, so changing them makes the stage stale, whereas options
+# (e.g., the number of workers) aren't
+class Stage:
+    def __init__(self, name, fn, inputs=(), outputs=(), deps=(), params=None, options=None):
+        self.name = name
+        self.fn = fn
+        self.inputs = [Path(p) for p in inputs]
+        self.outputs = [Path(p) for p in outputs]
+        self.deps = list(deps)
+        self.params = {} if params is None else params
+        self.options = {} if options is None else options
+
+# function to get the sha256 hash of a file's contents (None if it doesn't exist)
+def hash_file(path, chunk_size=1 << 20):
+    path = Path(path)
+    if not path.is_file():
+        return None
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def hash_files(paths):
+    return {str(p): hash_file(p) for p in paths}
+
+# function to get what a stage's outputs would be made from now: the hashes of its input files, and its parameters
+def get_stage_key(stage):
+    return {'inputs': hash_files(stage.inputs), 'params': json.loads(json.dumps(stage.params))}  # as it will be read back from file
+
+# function to get the reasons a stage needs to be run (an empty list if it's up to date), from its key and its record from the last run
+# a stage is stale if it hasn't been run, if its parameters or the contents of any of its inputs have changed, or if any of its outputs
+# are missing or have changed since it was run
+def get_stale_reasons(stage, key, record):
+    if record is None:
+        return ['not run before']
+    reasons = []
+    if key['params'] != record['params']:
+        reasons.append('parameters changed')
+    reasons += [f'{path} changed' for path, h in key['inputs'].items() if h != record['inputs'].get(path)]
+    for path, h in hash_files(stage.outputs).items():
+        if h is None:
+            reasons.append(f'{path} missing')
+        elif h != record['outputs'].get(path):
+            reasons.append(f'{path} changed since it was made')
+    return reasons
+
+def load_state(state_path):
+    if not Path(state_path).exists():
+        return {}
+    with open(state_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# function to run a stage in a worker process, with its own run report (which is sent back, to be merged into the main one)
+def call_stage(fn, kwargs):
+    report = __instrument__.RunReport()
+    fn(report=report, **kwargs)
+    return report
+
+# function to run the stages that are stale, skipping those that are up to date, and record what each was made from in state_path
+# stages run as soon as the stages they depend on have finished, up to max_parallel at a time, so independent stages run concurrently
+# a stage whose inputs are made by an earlier stage is only stale if the contents of those files actually changed
+# the stages in force are run even if they're up to date
+# if a stage fails, the stages already running are finished (and recorded), but no more are started
+def run_pipeline(stages, state_path, force=(), max_parallel=2, report=None):
+    report = __instrument__.RunReport() if report is None else report
+    stages = {stage.name: stage for stage in stages}
+    unknown = sorted({*[d for stage in stages.values() for d in stage.deps], *force} - set(stages))
+    if len(unknown) > 0:
+        raise ValueError(f'Unknown stages {unknown} - expected any of {list(stages)}')
+    order = list(TopologicalSorter({name: stage.deps for name, stage in stages.items()}).static_order())  # raises CycleError for cycles
+
+    state = load_state(state_path)
+    done = set()
+    running = {}  # future: (stage, key)
+    error = None
+    with ProcessPoolExecutor(max_workers=max_parallel) as executor:
+        while len(running) > 0 or (error is None and len(done) < len(stages)):
+            # start (or skip) every stage that's ready, in order, so skipped stages make the stages after them ready in the same pass
+            for name in order if error is None else []:
+                stage = stages[name]
+                if name in done or any(stage is s for s, _ in running.values()) or not all(d in done for d in stage.deps):
+                    continue
+                key = get_stage_key(stage)
+                reasons = ['forced'] if name in force else get_stale_reasons(stage, key, state.get(name))
+                if len(reasons) == 0:
+                    print(f'Skipping {name} (up to date)')
+                    report.count('stages_skipped')
+                    done.add(name)
+                    continue
+                print(f'Running {name} ({", ".join(reasons)})')
+                running[executor.submit(call_stage, stage.fn, {**stage.params, **stage.options})] = (stage, key)
+
+            if len(running) == 0:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, key = running.pop(future)
+                try:
+                    report.merge(future.result())
+                except Exception as e:
+                    print(f'{stage.name} failed: {e!r}')
+                    error = e if error is None else error
+                    continue
+                state[stage.name] = {**key, 'outputs': hash_files(stage.outputs), 'finished': time.strftime('%Y-%m-%dT%H:%M:%S')}
+                __instrument__.save_json_atomic(state, state_path, indent=2)
+                report.count('stages_run')
+                done.add(stage.name)
+
+    if error is not None:
+        raise error
+    return report
@@ -0,0 +1,68 @@
+import numpy as np
+import warnings
+
+# function to split total into whole numbers in proportion to weights, using the largest remainder method
+# (ties in the remainders go to whichever comes first)
+def apportion(weights, total):
+    weights = np.asarray(weights, dtype=float)
+    expected = total * weights / weights.sum()
+    counts = np.floor(expected).astype(int)
+    remainders = expected - counts
+    n_extra = total - counts.sum()
+    counts[np.argsort(-remainders, kind='stable')[:n_extra]] += 1
+    return counts
+
+# function to get a table of how many samples to generate for each combination of letter and font, such that the total number of
+# images is total_images, and the number for each letter and font is in proportion to how often they are used
+# letter_freqs is the letter_frequencies.csv table (letter, n, p), and fonts_df is the font_frequencies.csv table (ttf_path, plus usage stats)
+# the weights can be flattened (or sharpened) with the exponents, e.g., 0.5 to sample in proportion to the square root of font usage
+# every combination gets at least min_samples, and any combinations with 0 samples are dropped from the plan
+# returns a dataframe with columns letter, font, n_samples (one row per combination, font-major)
+def make_sampling_plan(letter_freqs, fonts_df, total_images, letters=None, font_weight_col='views', letter_weight_exponent=1.0,
+                       font_weight_exponent=1.0, min_samples=0):
+    import pandas as pd
+    letter_freqs = letter_freqs.set_index('letter')
+    letters = letter_freqs.index.tolist() if letters is None else letters
+    letter_wts = letter_freqs.loc[letters, 'p'].to_numpy(dtype=float) ** letter_weight_exponent
+
+    if font_weight_col in fonts_df.columns:
+        font_wts = pd.to_numeric(fonts_df[font_weight_col], errors='coerce').fillna(0).to_numpy(dtype=float) ** font_weight_exponent
+    else:
+        warnings.warn(f'No "{font_weight_col}" column in the font table - weighting all fonts equally')
+        font_wts = np.ones(len(fonts_df))
+
+    n_units = len(letters) * len(fonts_df)
+    if min_samples * n_units > total_images:
+        raise ValueError(f'Cannot give {n_units} letter and font combinations {min_samples} samples each with a budget of {total_images} images')
+
+    unit_wts = np.outer(font_wts, letter_wts).ravel()
+    n = min_samples + apportion(unit_wts, total_images - min_samples * n_units)
+
+    plan = pd.DataFrame({'letter': np.tile(letters, len(fonts_df)),
+                         'font': np.repeat(fonts_df.ttf_path.to_numpy(), len(letters)),
+                         'n_samples': n})
+
+    return plan.loc[plan.n_samples > 0].reset_index(drop=True)
+
+# designs that get_unit_design can use
+designs = ['uniform', 'lhs', 'grid']
+
+# function to get n points in the unit hypercube, [0, 1) in each of n_dims dimensions, as an array of shape n * n_dims
+# 'uniform' draws every value independently (one dimension at a time, so the first dimensions don't depend on n_dims)
+# 'lhs' is a latin hypercube, where each dimension is split into n equal strata, with one point (at a random place) in each
+# 'grid' puts the points evenly along a grid (at the centres of its cells) over the first n_grid_dims dimensions, with any other
+# dimensions drawn independently
+def get_unit_design(rng, n, n_dims, design='uniform', n_grid_dims=2):
+    if design == 'uniform':
+        return np.stack([rng.random(n) for _ in range(n_dims)], axis=1).reshape(n, n_dims)
+    elif design == 'lhs':
+        return np.stack([(rng.permutation(n) + rng.random(n)) / n for _ in range(n_dims)], axis=1).reshape(n, n_dims)
+    elif design == 'grid':
+        n_grid_dims = min(n_grid_dims, n_dims)
+        k = int(np.ceil(n ** (1/n_grid_dims))) if n > 0 else 0  # points per grid dimension
+        cells = (np.arange(n) * k**n_grid_dims) // max(n, 1)  # spread the points over all k ** n_grid_dims cells
+        grid = (np.stack(np.unravel_index(cells, (k,) * n_grid_dims), axis=1) + 0.5) / max(k, 1)
+        rest = [rng.random(n) for _ in range(n_dims - n_grid_dims)]
+        return np.column_stack([grid, *rest]).reshape(n, n_dims)
+    else:
+        raise ValueError(f'Unknown design "{design}" - expected one of {designs}')
@@ -0,0 +1,219 @@
+import generate_images
+import __fonts__
+
+import numpy as np
+import pandas as pd
+from PIL import ImageFont
+import PIL
+from pathlib import Path
+import tempfile
+import tracemalloc
+import platform
+import argparse
+import warnings
+import time
+import json
+import os
+import sys
+import subprocess
+
+# startup budgets: heavy modules that importing each module in a new process mustn't load (these are loaded only by the functions that
+# need them, so that worker processes and the command line start quickly), and the time it should take to import, as a multiple of the
+# time to import the libraries every module needs anyway (numpy and PIL) in the same way
+# the time is relative, as absolute times vary too much with the machine and whatever else it's running, and is only a warning
+import_forbidden = {'generate_images': ['pandas', 'git', 'google.protobuf'],
+                    '__fonts__': ['pandas', 'git', 'google.protobuf', 'generate_images'],
+                    'get_google_fonts': ['pandas', 'git', 'google.protobuf', 'generate_images'],
+                    '__output__': ['pandas'],
+                    '__sampling__': ['pandas'],
+                    '__pipeline__': ['pandas', 'numpy', 'PIL']}
+import_budgets = {'generate_images': 2.5, '__fonts__': 2.5, 'get_google_fonts': 2.5, '__output__': 2.0, '__sampling__': 1.5, '__pipeline__': 1.5}
+import_baseline = 'numpy, PIL.Image, PIL.ImageFont, PIL.ImageDraw'
+
+# function to get the time (ms) to import modules (a comma-separated string) in a new python process (the median of n_repeats),
+# along with the modules that importing them loaded
+def get_import_time(modules, n_repeats=5):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(Path(__file__).resolve().parent), os.environ.get('PYTHONPATH', '')]))
+    times = []
+    for _ in range(n_repeats):
+        proc = subprocess.run([sys.executable, '-c', f'import sys, time; t0 = time.perf_counter(); import {modules}; '
+                                                     'print((time.perf_counter() - t0) * 1000); print(" ".join(sys.modules))'],
+                              env=env, capture_output=True, text=True, check=True)
+        ms, loaded = proc.stdout.splitlines()
+        times.append(float(ms))
+    return float(np.median(times)), loaded.split()
+
+# function to check the startup budgets, printing the import time of each module relative to the baseline
+# returns whether no module loaded any forbidden modules (going over a time budget only prints a warning), and a list of results
+def check_import_budgets(budgets=import_budgets, forbidden=import_forbidden, baseline=import_baseline):
+    baseline_ms, _ = get_import_time(baseline)
+    print(f'baseline import {baseline}: {baseline_ms:.0f} ms')
+    passed = True
+    results = []
+    for module, budget in budgets.items():
+        ms, loaded = get_import_time(module)
+        loaded_forbidden = [m for m in forbidden.get(module, []) if m in loaded]
+        passed = passed and len(loaded_forbidden) == 0
+        print(f'{"ok  " if len(loaded_forbidden) == 0 else "FAIL"} import {module}: {ms:.0f} ms ({ms/baseline_ms:.2f} x baseline)' +
+              (f', loaded {", ".join(loaded_forbidden)}' if len(loaded_forbidden) > 0 else '') +
+              (f' - WARNING: over its budget of {budget} x baseline' if ms > budget*baseline_ms else ''))
+        results.append({'module': module, 'import_ms': ms, 'baseline_ms': baseline_ms, 'relative': ms / baseline_ms, 'budget': budget,
+                        'loaded_forbidden': loaded_forbidden})
+    return passed, results
+
+# function to get the fonts to benchmark with, without needing the google-fonts repository or a network connection
+# the default font bundled with PIL is written to font_dir, and any extra font files are added to the list
+def get_bench_fonts(font_dir, extra_fonts=()):
+    font_dir = Path(font_dir)
+    font_dir.mkdir(parents=True, exist_ok=True)
+    pil_font_path = font_dir / 'PILDefault-Regular.ttf'
+    pil_font_path.write_bytes(ImageFont.load_default(size=10).font_bytes)
+    return [str(pil_font_path), *[str(f) for f in extra_fonts]]
+
+def clear_font_caches():
+    generate_images.load_font.cache_clear()
+    generate_images.load_font_bytes.cache_clear()
+    generate_images.get_glyph_boxes.cache_clear()
+
+# function to time fn, called once per set of arguments in args_list, and measure its peak (python-tracked) memory use
+# font caches are cleared first, so every stage starts cold
+# memory is measured in a separate run, as tracing allocations slows everything down
+def time_stage(fn, args_list, measure_memory=True):
+    clear_font_caches()
+    t0 = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    seconds = time.perf_counter() - t0
+
+    if not measure_memory:
+        return seconds, np.nan
+
+    clear_font_caches()
+    tracemalloc.start()
+    for args in args_list:
+        fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+# function to get random sample parameters that keep the letter on the canvas, as (letter, x, y, size, rotation) tuples
+def get_bench_samples(rng, n, canvas_size, font_size):
+    letters = rng.choice(generate_images.letters, size=n)
+    rotations = rng.uniform(-15, 15, size=n).round(3)
+    xy = rng.uniform(canvas_size*0.5 - 1, canvas_size*0.5 + 1, size=(n, 2)).round(3)  # near the centre, so even large letters fit
+    return [(L, x, y, font_size, r) for L, (x, y), r in zip(letters, xy, rotations)]
+
+# function to benchmark each rendering and validation stage for each font, canvas size, and font size
+def run_stage_benchmarks(fonts, canvas_sizes, font_size_factors, n, seed=0):
+    results = []
+    rng = np.random.default_rng(seed)
+
+    for F in fonts:
+        for canvas_size in canvas_sizes:
+            canvas_dims = (canvas_size, canvas_size)
+            for size_factor in font_size_factors:
+                font_size = round(canvas_size * size_factor, 3)
+                samples = get_bench_samples(rng, n, canvas_size, font_size)
+
+                stages = {
+                    'load_font': (lambda L, x, y, S, R: generate_images.load_font(F, S + rng.uniform(0, 1))),  # a new size each call
+                    'get_letter_vertices': (lambda L, x, y, S, R: generate_images.get_letter_vertices(L, font_file=F, font_size=S, rotation=R)),
+                    'render_text_im': (lambda L, x, y, S, R: generate_images.render_text_im(L, font_file=F, x=x, y=y, font_size=S, rotation=R, canvas_dims=canvas_dims)),
+                    'render_text_array': (lambda L, x, y, S, R: generate_images.render_text_array(L, font_file=F, x=x, y=y, font_size=S, rotation=R, canvas_dims=canvas_dims)),
+                }
+                for stage, fn in stages.items():
+                    seconds, peak = time_stage(fn, samples)
+                    results.append({'stage': stage, 'font': Path(F).name, 'canvas_size': canvas_size, 'font_size': font_size, 'n': n,
+                                    'seconds': seconds, 'images_per_s': n / seconds, 'peak_mem_mb': peak / 1e6})
+
+                # placement for a whole block of samples at once
+                sizes = np.array([S for _, _, _, S, _ in samples])
+                rotations = np.array([R for _, _, _, _, R in samples])
+                seconds, peak = time_stage(lambda: generate_images.get_letter_vertices_batch('a', font_file=F, font_sizes=sizes, rotations=rotations), [()])
+                results.append({'stage': 'get_letter_vertices_batch', 'font': Path(F).name, 'canvas_size': canvas_size, 'font_size': font_size, 'n': n,
+                                'seconds': seconds, 'images_per_s': n / seconds, 'peak_mem_mb': peak / 1e6})
+
+            # validation of the font on all letters, as in get_google_fonts (which uses a canvas of 3 * font size)
+            font_size = canvas_size / 3
+            seconds, peak = time_stage(lambda: __fonts__.font_succeeds(generate_images.letters, font=F, font_size=font_size, canvas_dims=canvas_dims), [()])
+            results.append({'stage': 'font_succeeds', 'font': Path(F).name, 'canvas_size': canvas_size, 'font_size': font_size, 'n': len(generate_images.letters),
+                            'seconds': seconds, 'images_per_s': len(generate_images.letters) / seconds, 'peak_mem_mb': peak / 1e6})
+
+    return results
+
+# function to benchmark the end-to-end generation loop (generate_images.main), in a temporary directory
+# (peak memory isn't measured here, as it would mean generating everything twice)
+def run_generation_benchmark(fonts, output_format='png', n_workers=1):
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        try:
+            Path('freqs').mkdir()
+            pd.DataFrame({'ttf_path': fonts}).to_csv(Path('freqs') / 'font_frequencies.csv')
+            n_images = generate_images.n_samples * len(generate_images.letters) * len(fonts)
+            seconds, peak = time_stage(lambda: generate_images.main(n_workers=n_workers, output_format=output_format), [()], measure_memory=False)
+            bytes_written = sum(f.stat().st_size for f in Path('ims').rglob('*') if f.is_file())
+        finally:
+            os.chdir(old_cwd)
+
+    return {'stage': f'generate_images.main ({output_format})', 'font': f'{len(fonts)} fonts', 'canvas_size': generate_images.canvas_dims[0],
+            'font_size': None, 'n': n_images, 'seconds': seconds, 'images_per_s': n_images / seconds, 'peak_mem_mb': peak,
+            'bytes_written': bytes_written}
+
+# function to print the results, with the change in throughput from a previous run's results if given
+def print_results(results, previous=None):
+    df = pd.DataFrame(results)
+    if previous is not None:
+        key_cols = ['stage', 'font', 'canvas_size', 'font_size']
+        prev_df = pd.DataFrame(previous)[key_cols + ['images_per_s']].rename(columns={'images_per_s': 'previous_images_per_s'})
+        df = pd.merge(df, prev_df, on=key_cols, how='left')
+        df['speedup'] = df.images_per_s / df.previous_images_per_s
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(df.drop(columns=['seconds']).round(3).to_string(index=False))
+
+def main(out_path='benchmark.json', extra_fonts=(), canvas_sizes=(64, 128, 256), font_size_factors=(0.125, 0.5), n=200,
+         generation=True, compare_path=None):
+    warnings.simplefilter('ignore')  # e.g., for setting a variation on fonts that aren't variable
+
+    with tempfile.TemporaryDirectory() as font_dir:
+        fonts = get_bench_fonts(font_dir, extra_fonts=extra_fonts)
+        results = run_stage_benchmarks(fonts, canvas_sizes=canvas_sizes, font_size_factors=font_size_factors, n=n)
+        if generation:
+            results.append(run_generation_benchmark(fonts))
+
+    # startup costs are checked on every benchmark run, not only with --check-imports
+    imports_ok, import_results = check_import_budgets()
+
+    report = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'platform': platform.platform(),
+                       'numpy': np.__version__, 'pillow': PIL.__version__, 'cpu_count': os.cpu_count()},
+              'results': results, 'imports': import_results}
+
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    previous = None
+    if compare_path is not None:
+        with open(compare_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)['results']
+
+    print_results(results, previous=previous)
+    print(f'Saved benchmark results to {out_path}')
+    if not imports_ok:
+        print('FAILED startup check: some modules load heavy dependencies at import time (see above)')
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the rendering, validation, and generation stages, using fonts that are available offline')
+    parser.add_argument('--out', default='benchmark.json', help='file to save the results to (json)')
+    parser.add_argument('--compare', default=None, help='results file from a previous run, to compare throughput against')
+    parser.add_argument('--fonts', nargs='*', default=[], help='extra font files to benchmark, as well as the font bundled with PIL')
+    parser.add_argument('--canvas-sizes', nargs='*', type=int, default=[64, 128, 256], help='canvas sizes (pixels) to benchmark')
+    parser.add_argument('--font-size-factors', nargs='*', type=float, default=[0.125, 0.5], help='font sizes to benchmark, as proportions of the canvas size')
+    parser.add_argument('-n', type=int, default=200, help='number of calls per stage')
+    parser.add_argument('--no-generation', action='store_true', help='skip the end-to-end generation benchmark')
+    parser.add_argument('--check-imports', action='store_true', help='only check the startup import budgets (exits with status 1 if any module loads a forbidden dependency)')
+    args = parser.parse_args()
+    if args.check_imports:
+        sys.exit(0 if check_import_budgets()[0] else 1)
+    main(out_path=args.out, extra_fonts=args.fonts, canvas_sizes=args.canvas_sizes, font_size_factors=args.font_size_factors, n=args.n,
+         generation=not args.no_generation, compare_path=args.compare)
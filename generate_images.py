@@ -1,11 +1,42 @@
 import numpy as np
-import pandas as pd
 from PIL import Image, ImageDraw, ImageFont
 from string import ascii_letters
 from pathlib import Path
-import shutil
 from tqdm import tqdm
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import hashlib
+import heapq
+import ast
+import math
+import argparse
+from io import BytesIO
 import warnings
+import __output__
+import __sampling__
+import __instrument__
+
+# pandas is only imported by the functions that need it (see below), so that processes that only render or validate fonts,
+# and the command line, start quickly
+
+# bounds on the font caches (per process)
+font_cache_size = 128  # number of (font file, size, variation) combinations to keep loaded
+font_bytes_cache_size = 64  # number of font files to keep in memory as raw bytes
+
+# most samples of a work unit that are rendered (and sent back from a worker) at once, which bounds the memory each unit in flight
+# takes, however many samples a sampling plan gives it, and keeps each chunk's sizes within the font cache, so the faces loaded to
+# place its samples are still loaded when they are rendered
+max_chunk_samples = 64
+
+# default generation settings
+letters = [*ascii_letters, 'ä', 'ö', 'ü', 'Ä', 'Ö', 'Ü', 'ß']
+n_samples = 8  # per combination of font and letter
+canvas_dims = (256, 256)
+rotation_bounds = (-15, 15)
+size_bounds = (16, 0.5*max(canvas_dims))
+decimals = 3  # number of decimals to round all variables to
+seed = 25102025
 
 def rotate_point(x, y, origin_x, origin_y, r_degrees):
     r = np.radians(-r_degrees)
@@ -27,9 +58,24 @@ def rotate_bbox_to_vertices(bbox, rotation=0.0):
     br = rotate_point(x1, y1, origin_x=centre_x, origin_y=centre_y, r_degrees=rotation)
     return (tl, tr, br, bl)  # order works with pil polygon input
 
-def get_letter_vertices(letter, font_file='arial.ttf', font_size=128, rotation=0.0, variation='Regular'):
-    # calculates the bbox with rotation
-    font = ImageFont.truetype(font_file, font_size)
+# function to read a font file once, so that loading the same face at new sizes doesn't touch the disk again
+@lru_cache(maxsize=font_bytes_cache_size)
+def load_font_bytes(font_file):
+    with open(font_file, 'rb') as f:
+        return f.read()
+
+# function to get a font at a given size and variation, reusing already-loaded fonts where possible
+# the cache only helps when the exact same size is asked for again (e.g., validation at a fixed size, or rendering a sample at the
+# size it was just measured at in get_unit_params); generation draws a new continuous size for every sample, so each sample still
+# opens a new FreeType face (from the bytes in memory, so without reading the file again) - Pillow has no way to reuse one parsed
+# face at different sizes (font_variant also opens a new face)
+@lru_cache(maxsize=font_cache_size)
+def load_font(font_file='arial.ttf', font_size=128, variation='Regular'):
+    try:
+        font = ImageFont.truetype(BytesIO(load_font_bytes(font_file)), font_size)
+    except OSError:
+        # e.g., fonts that PIL finds by name in the system font directories rather than by path
+        font = ImageFont.truetype(font_file, font_size)
 
     # if a variation is requested, try to set to the requested variation
     if variation is not None:
@@ -41,24 +87,126 @@ def get_letter_vertices(letter, font_file='arial.ttf', font_size=128, rotation=0
         except ValueError:
             warnings.warn(f'Got ValueError setting variation to "{variation}" - does the font support this variation?')
             pass  # e.g., will throw a ValueError if the requested variation is missing
-    
+
+    return font
+
+def get_letter_vertices(letter, font_file='arial.ttf', font_size=128, rotation=0.0, variation='Regular'):
+    # calculates the bbox with rotation
+    font = load_font(font_file, font_size, variation)
     bbox = font.getbbox(letter, anchor='mm')
     vertices = rotate_bbox_to_vertices(bbox, rotation=rotation)
     return vertices
 
-def render_text_im(letter, font_file='arial.ttf', x=128, y=128, font_size=128, rotation=0.0, canvas_dims=(256, 256), variation='Regular', draw_bounds=False):
-    font = ImageFont.truetype(font_file, font_size)
+# function to get the bounding boxes (with anchor 'mm') of each character in chars (a string, or tuple of characters) for one font
+# returns an int array of shape N * 4 (x0, y0, x1, y1)
+@lru_cache(maxsize=font_cache_size)
+def get_glyph_boxes(font_file, chars, font_size=128, variation='Regular'):
+    font = load_font(font_file, font_size, variation)
+    return np.array([font.getbbox(c, anchor='mm') for c in chars], dtype=int).reshape(len(chars), 4)
 
-    # if a variation is requested, try to set to the requested variation
-    if variation is not None:
-        try:
-            font.set_variation_by_name(variation)
-        except OSError:
-            warnings.warn('Got OSError setting variation - is it really a variation font?')
-            pass  # e.g., will throw an OSError if not a variation font
-        except ValueError:
-            warnings.warn(f'Got ValueError setting variation to "{variation}" - does the font support this variation?')
-            pass  # e.g., will throw a ValueError if the requested variation is missing
+# an atlas of characters in one font at one size, rasterised in a single pass into one packed uint8 buffer
+# buffer is a strip with a slot for each character, side by side: slots[i] is (x0, y0, x1, y1) of character i's slot in the buffer,
+# boxes[i] is its bounding box relative to its anchor (anchor 'mm'), and anchors[i] is where its anchor is in the buffer
+# each character is drawn with its anchor at the same subpixel position as origin, so it is rasterised exactly as it would be if
+# drawn on a canvas at origin
+class GlyphAtlas:
+    def __init__(self, chars, buffer, slots, boxes, anchors):
+        self.chars = list(chars)
+        self.buffer = buffer
+        self.slots = slots
+        self.boxes = boxes
+        self.anchors = anchors
+
+    # the part of the buffer holding character i
+    def get_slot(self, i):
+        x0, y0, x1, y1 = self.slots[i]
+        return self.buffer[y0:y1, x0:x1]
+
+    # the inked pixels of character i, cropped to their bounding box, and the position of that box's top-left corner
+    # relative to the character's anchor (rounded down to whole pixels), or None if the character has no ink
+    def get_ink(self, i):
+        slot = self.get_slot(i)
+        rows = np.flatnonzero(slot.any(axis=1))
+        if len(rows) == 0:
+            return None
+        cols = np.flatnonzero(slot.any(axis=0))
+        ink = slot[rows[0]:rows[-1]+1, cols[0]:cols[-1]+1]
+        ink_x = self.slots[i][0] + cols[0] - int(np.floor(self.anchors[i][0]))
+        ink_y = self.slots[i][1] + rows[0] - int(np.floor(self.anchors[i][1]))
+        return ink, (ink_x, ink_y)
+
+# function to rasterise every character in chars for one font into a GlyphAtlas
+# pad is the number of pixels around each character's bounding box in its slot, in case any ink falls outside the box
+def build_glyph_atlas(font_file, chars, font_size=128, variation='Regular', origin=(0.0, 0.0), pad=2):
+    font = load_font(font_file, font_size, variation)
+    boxes = get_glyph_boxes(font_file, tuple(chars), font_size, variation)
+
+    frac_x, frac_y = origin[0] - np.floor(origin[0]), origin[1] - np.floor(origin[1])
+    slot_widths = boxes[:, 2] - boxes[:, 0] + 2*pad
+    slot_x0 = np.concatenate([[0], np.cumsum(slot_widths)[:-1]])
+    height = boxes[:, 3].max(initial=0) - boxes[:, 1].min(initial=0) + 2*pad
+    anchor_y = pad - boxes[:, 1].min(initial=0) + frac_y
+
+    buffer = Image.new('L', (int(slot_widths.sum()), int(height)), color=0)
+    draw = ImageDraw.Draw(buffer)
+    anchors = []
+    for char, box, x0 in zip(chars, boxes, slot_x0):
+        anchor = (x0 + pad - box[0] + frac_x, anchor_y)
+        draw.text(anchor, char, fill=255, font=font, anchor='mm')
+        anchors.append(anchor)
+
+    slots = np.stack([slot_x0, np.zeros_like(slot_x0), slot_x0 + slot_widths, np.full_like(slot_x0, height)], axis=1)
+    return GlyphAtlas(chars, np.asarray(buffer), slots, boxes, np.array(anchors).reshape(len(chars), 2))
+
+# function to estimate a letter's bounding box (with anchor 'mm') at many font sizes at once, from a single measurement at ref_size
+# bounding boxes scale with font size, other than hinting and the rounding of box and anchor positions to whole pixels, so the scaled
+# boxes are padded by margin pixels (in each direction) to allow for this
+# the margin is only an allowance, not a bound: the error depends on the font (up to ~3 px at sizes 16-128 on some fonts, and more
+# above that), so anything that needs the exact box should measure it at each size (see measure_letter_bboxes)
+# returns an array of shape N * 4 (x0, y0, x1, y1)
+def get_letter_bboxes(letter, font_file='arial.ttf', font_sizes=(128,), variation='Regular', ref_size=1000, margin=2):
+    ref_bbox = get_glyph_boxes(font_file, letter, ref_size, variation)[0].astype(float)
+    bboxes = ref_bbox[np.newaxis, :] * (np.asarray(font_sizes, dtype=float)[:, np.newaxis] / ref_size)
+    return bboxes + np.array([-margin, -margin, margin, margin])
+
+# function to measure a letter's bounding box (with anchor 'mm') at each font size, exactly as render_text_array does
+# this loads the font at each size (which rendering at that size needs anyway) but doesn't rasterise anything
+# returns an array of shape N * 4 (x0, y0, x1, y1)
+def measure_letter_bboxes(letter, font_file='arial.ttf', font_sizes=(128,), variation='Regular'):
+    return np.array([load_font(font_file, S, variation).getbbox(letter, anchor='mm') for S in font_sizes], dtype=float).reshape(-1, 4)
+
+# vectorised equivalent of get_letter_vertices, for many sizes and rotations at once
+# returns an array of shape N * 4 (tl, tr, br, bl) * 2 (x, y)
+def get_letter_vertices_batch(letter, font_file='arial.ttf', font_sizes=(128,), rotations=(0.0,), variation='Regular', ref_size=1000, margin=2):
+    bboxes = get_letter_bboxes(letter, font_file=font_file, font_sizes=font_sizes, variation=variation, ref_size=ref_size, margin=margin)
+    vertices = rotate_bbox_to_vertices(bboxes.T, rotation=np.asarray(rotations, dtype=float))  # rotates all boxes' corners at once
+    return np.stack([np.stack(v, axis=-1) for v in vertices], axis=1)
+
+# function to estimate the largest font size at which a letter's bounding box still fits on the canvas at each rotation, using the
+# scaled boxes of get_letter_bboxes
+# the scaled box's width and height after rotation are linear in font size, so this is exact for the scaled box, but (as the scaled box
+# is only an estimate) not necessarily for the box measured at that size
+# returns an array with the same shape as rotations
+def get_max_fitting_sizes(letter, font_file='arial.ttf', rotations=(0.0,), canvas_dims=(256, 256), variation='Regular', ref_size=1000, margin=2):
+    ref_bbox = get_glyph_boxes(font_file, letter, ref_size, variation)[0].astype(float) / ref_size  # box at font size 1
+    w1, h1 = ref_bbox[2] - ref_bbox[0], ref_bbox[3] - ref_bbox[1]
+    r = np.radians(np.asarray(rotations, dtype=float))
+    abs_cos, abs_sin = np.abs(np.cos(r)), np.abs(np.sin(r))
+    with np.errstate(divide='ignore'):  # (an empty box fits at any size)
+        max_x = (canvas_dims[0] - 1 - 2*margin*(abs_cos + abs_sin)) / (w1*abs_cos + h1*abs_sin)
+        max_y = (canvas_dims[1] - 1 - 2*margin*(abs_cos + abs_sin)) / (w1*abs_sin + h1*abs_cos)
+    return np.minimum(max_x, max_y)
+
+# function to check whether a letter's bounding box, after rotation, goes over the canvas limits
+def check_canvas_bounds(text_bbox, rotation, canvas_dims):
+    tl, tr, br, bl = rotate_bbox_to_vertices(text_bbox, rotation=rotation)
+    verts_array = np.round([tl, tr, br, bl])  # shape 4 (vertices) * 2 (x, y)
+    if np.any(verts_array<0) or np.any(verts_array[:, 0]>(canvas_dims[0]-1)) or np.any(verts_array[:, 1]>(canvas_dims[1]-1)):
+        raise ValueError(f'Canvas dimensions exceeded! {tl, tr, br, bl}')
+    return (tl, tr, br, bl)
+
+def render_text_im(letter, font_file='arial.ttf', x=128, y=128, font_size=128, rotation=0.0, canvas_dims=(256, 256), variation='Regular', draw_bounds=False):
+    font = load_font(font_file, font_size, variation)
 
     im   = Image.new('L', canvas_dims, color=0)
     draw = ImageDraw.Draw(im)
@@ -70,80 +218,497 @@ def render_text_im(letter, font_file='arial.ttf', x=128, y=128, font_size=128, r
     im = im.rotate(rotation, center=text_centre)  # rotate using the text location as the centre of rotation
 
     # check whether the text goes over the canvas limits
-    tl, tr, br, bl = rotate_bbox_to_vertices(text_bbox, rotation=rotation)
-    verts_array = np.round([tl, tr, br, bl])
-    if np.any(verts_array<0) or np.any(verts_array[0, :]>(canvas_dims[0]-1)) or np.any(verts_array[1, :]>(canvas_dims[1]-1)):
-        raise ValueError(f'Canvas dimensions exceeded! {tl, tr, br, bl}')
+    tl, tr, br, bl = check_canvas_bounds(text_bbox, rotation=rotation, canvas_dims=canvas_dims)
 
     if draw_bounds:
         draw = ImageDraw.Draw(im)
         draw.polygon((tl, tr, br, bl), outline=255, width=5)
     return im
 
+# function to get the affine matrix that Image.rotate would use to rotate a whole canvas about centre, shifted to a window of that canvas
+# whose top-left corner is at offset (a whole number of pixels), such that sampling the window gives exactly the same pixels as sampling
+# the canvas. PIL samples nearest-neighbour affine transforms with 16.16 fixed point coordinates, so the window's translation is snapped to
+# the fixed point grid of the full canvas's transform, rather than just shifted (which would round differently to the full canvas).
+def get_window_rotation_matrix(rotation, centre, offset):
+    # as in Image.rotate
+    angle = -math.radians(float(rotation) % 360.0)
+    a, b, d, e = round(math.cos(angle), 15), round(math.sin(angle), 15), round(-math.sin(angle), 15), round(math.cos(angle), 15)
+    c = a * -centre[0] + b * -centre[1] + centre[0]
+    f = d * -centre[0] + e * -centre[1] + centre[1]
+
+    # as in PIL's fixed point affine transform
+    def fix(v):
+        return math.floor(v * 65536.0 + 0.5)
+
+    if b == 0 and d == 0:
+        # no rotation (PIL doesn't use fixed point here) - the window is just a translation of the canvas
+        return (a, b, c + a*offset[0] - offset[0], d, e, f + e*offset[1] - offset[1])
+
+    a_fix, b_fix, d_fix, e_fix = fix(a), fix(b), fix(d), fix(e)
+    c_fix = fix(c + a * 0.5 + b * 0.5) + offset[0]*a_fix + offset[1]*b_fix - offset[0]*65536
+    f_fix = fix(f + d * 0.5 + e * 0.5) + offset[0]*d_fix + offset[1]*e_fix - offset[1]*65536
+    c_win = c_fix/65536 - a * 0.5 - b * 0.5
+    f_win = f_fix/65536 - d * 0.5 - e * 0.5
+    return (a, b, c_win, d, e, f_win)
+
+# faster equivalent of render_text_im, returning a uint8 array of shape height * width (written into out, if given)
+# rather than drawing and rotating the whole canvas, the glyph is rasterised into a window around the letter, which is the only part
+# that the rotation (a single affine warp) needs to touch, and the result is copied into the output buffer
+# the window is offset from the canvas by whole pixels, so the glyph is rasterised with the same subpixel position, and the rotation
+# samples the same pixels as rotating the whole canvas, so the output matches render_text_im pixel-for-pixel
+def render_text_array(letter, font_file='arial.ttf', x=128, y=128, font_size=128, rotation=0.0, canvas_dims=(256, 256), variation='Regular', out=None,
+                      max_window_fraction=0.5):
+    font = load_font(font_file, font_size, variation)
+
+    if out is None:
+        out = np.zeros((canvas_dims[1], canvas_dims[0]), dtype=np.uint8)
+    else:
+        out[:] = 0
+
+    x, y = float(x), float(y)  # plain floats are much faster than numpy scalars for the per-sample arithmetic here
+    bbox = font.getbbox(letter, anchor='mm')
+    text_bbox = (bbox[0]+x, bbox[1]+y, bbox[2]+x, bbox[3]+y)
+    check_canvas_bounds(text_bbox, rotation=rotation, canvas_dims=canvas_dims)
+
+    # window that contains the glyph at any rotation about its centre (plus a margin), clipped to the canvas
+    centre_x = text_bbox[0] + (text_bbox[2]-text_bbox[0])/2
+    centre_y = text_bbox[1] + (text_bbox[3]-text_bbox[1])/2
+    radius = math.hypot(text_bbox[2]-text_bbox[0], text_bbox[3]-text_bbox[1])/2 + 2
+    x0 = max(0, math.floor(centre_x - radius))
+    y0 = max(0, math.floor(centre_y - radius))
+    x1 = min(canvas_dims[0], math.ceil(centre_x + radius) + 1)
+    y1 = min(canvas_dims[1], math.ceil(centre_y + radius) + 1)
+
+    # when the window would cover most of the canvas (e.g., large letters on small canvases), it saves little, and its extra bookkeeping
+    # makes it slower than drawing and rotating the whole canvas, as render_text_im does
+    if (x1-x0) * (y1-y0) >= max_window_fraction * canvas_dims[0] * canvas_dims[1]:
+        im = Image.new('L', canvas_dims, color=0)
+        ImageDraw.Draw(im).text((x, y), letter, fill=255, font=font, anchor='mm')
+        out[:] = np.asarray(im.rotate(rotation, center=(centre_x, centre_y)))
+        return out
+
+    im = Image.new('L', (x1-x0, y1-y0), color=0)
+    draw = ImageDraw.Draw(im)
+    draw.text((x-x0, y-y0), letter, fill=255, font=font, anchor='mm')
+    matrix = get_window_rotation_matrix(rotation, centre=(centre_x, centre_y), offset=(x0, y0))
+    im = im.transform(im.size, Image.Transform.AFFINE, matrix, resample=Image.Resampling.NEAREST)
+
+    out[y0:y1, x0:x1] = np.asarray(im)
+    return out
+
 def get_google_font_list():
+    import pandas as pd
     fonts_df = pd.read_csv(Path('freqs') / 'font_frequencies.csv')
     return fonts_df.ttf_path.tolist()
 
-def main():
-    np.random.seed(25102025)
+# function to get the info on each font that is added to the index of the generated images (family, category, and usage stats),
+# from freqs/font_frequencies.csv
+def get_font_info():
+    import pandas as pd
+    font_df = pd.read_csv(Path('freqs') / 'font_frequencies.csv', index_col=0)
+    font_df = font_df.drop(columns=[c for c in ['font_dir', 'metadata_path', 'ttf'] if c in font_df.columns])
+    # categories are saved as lists (e.g., "['SANS_SERIF']"), but are easier to query as plain strings (e.g., "SANS_SERIF")
+    if 'category' in font_df.columns:
+        font_df['category'] = [', '.join(ast.literal_eval(c)) if isinstance(c, str) and c.startswith('[') else c for c in font_df.category]
+    return font_df
 
-    # settings
-    n_samples = 8  # per combination of font and letter
+# function to get a sampling plan that spreads a budget of total_images across letters and fonts in proportion to
+# freqs/letter_frequencies.csv and the usage stats in freqs/font_frequencies.csv, and save it to freqs/sampling_plan.csv
+def get_sampling_plan(total_images, letters=letters, **kwargs):
+    import pandas as pd
+    letter_freqs = pd.read_csv(Path('freqs') / 'letter_frequencies.csv', index_col=0)
+    fonts_df = pd.read_csv(Path('freqs') / 'font_frequencies.csv', index_col=0)
+    plan = __sampling__.make_sampling_plan(letter_freqs, fonts_df, total_images=total_images, letters=letters, **kwargs)
+    plan.to_csv(Path('freqs') / 'sampling_plan.csv', index=False)
+    return plan
+
+# function to get the list of work units, as (letter, font, n_samples) tuples, ordered by font
+# from a sampling plan if one is given, or else n_samples for every combination of letter and font
+def get_units(letters, fonts, n_samples=n_samples, plan=None):
+    if plan is not None:
+        return list(zip(plan.letter, plan.font, plan.n_samples.astype(int)))
+    return [(L, F, n_samples) for F in fonts for L in letters]  # font-major, so each font is loaded once per run
+
+# function to split work units into chunks of at most chunk_size samples, as (letter, font, n_samples, start, stop) tuples, in order
+# (each chunk is generated separately, see generate_unit)
+def get_unit_chunks(units, chunk_size=max_chunk_samples):
+    return [(L, F, n, start, min(start + chunk_size, n)) for L, F, n in units for start in range(0, n, chunk_size)]
+
+# function to split the work units between num_shards jobs (e.g., nodes of a batch scheduler), returning the units for job shard `shard`
+# the split depends only on the units, so each job works out the same assignment without needing to communicate with the others
+# units of a font go to the same job shard where possible, so each font is only loaded on one node, but a font that is more than a
+# shard's share of the total work is split by letter (each letter then costing its own font load), so no shard is much slower than the rest
+# fonts (or letters of split fonts) are assigned in order of decreasing cost to whichever shard has the least work so far (longest
+# processing time first), with the cost estimated as the number of images plus font_load_cost (in images) for loading the font
+# units keep their original order within each shard
+def get_shard_units(units, shard, num_shards, font_load_cost=8):
+    if not 0 <= shard < num_shards:
+        raise ValueError(f'Job shard {shard} does not exist - expected 0 to {num_shards-1}')
+
+    font_costs = {}
+    for _, F, n in units:
+        font_costs[F] = font_costs.get(F, font_load_cost) + n
+    shard_target = sum(font_costs.values()) / num_shards
+
+    # group units by (font, letter) for split fonts, and by (font, '') for the rest
+    def get_group(L, F):
+        return (F, L) if font_costs[F] > shard_target else (F, '')
+
+    group_costs = {}
+    for L, F, n in units:
+        group_costs[get_group(L, F)] = group_costs.get(get_group(L, F), font_load_cost) + n
+
+    shard_costs = [(0, i) for i in range(num_shards)]  # heap of (cost, shard), so ties go to the lowest shard index
+    group_shards = {}
+    for group, cost in sorted(group_costs.items(), key=lambda x: (-x[1], x[0])):
+        shard_cost, shard_i = heapq.heappop(shard_costs)
+        group_shards[group] = shard_i
+        heapq.heappush(shard_costs, (shard_cost + cost, shard_i))
+
+    return [(L, F, n) for L, F, n in units if group_shards[get_group(L, F)] == shard]
+
+# function to get the settings that images are generated with, which must match to resume or merge output
+def get_output_settings(seed=seed, output_format='png', shard_size=4096, plan=None, design='uniform'):
+    return {'seed': seed, 'n_samples': n_samples, 'canvas_dims': canvas_dims, 'rotation_bounds': rotation_bounds, 'size_bounds': size_bounds,
+            'decimals': decimals, 'design': design, 'output_format': output_format, 'shard_size': shard_size,
+            'plan': None if plan is None else hashlib.sha256(plan.to_csv(index=False).encode('utf-8')).hexdigest()}
+
+# function to get the output directory and canvas dimensions for each resolution that images are saved at, as (path, dims) tuples
+# the full resolution (canvas_dims) goes to ims, and each extra resolution, given as a canvas width, to ims_<width>x<height>
+# (extra resolutions must be smaller than the canvas, with the same aspect ratio)
+def get_resolution_outputs(resolutions=()):
+    outputs = [(Path('ims'), tuple(canvas_dims))]
+    for width in sorted(set(resolutions) - {canvas_dims[0]}, reverse=True):
+        height = canvas_dims[1] * width / canvas_dims[0]
+        if not 0 < width < canvas_dims[0] or height != int(height):
+            raise ValueError(f'Cannot save images {width} pixels wide - resolutions must be smaller than the canvas ({canvas_dims[0]} x {canvas_dims[1]}), '
+                             'with the same aspect ratio and a whole number of pixels in height')
+        outputs.append((Path(f'ims_{width}x{int(height)}'), (width, int(height))))
+    return outputs
+
+# function to get the settings for the images saved at a resolution of dims, from the settings for the full resolution
+def get_resolution_settings(settings, dims):
+    return settings if tuple(dims) == tuple(canvas_dims) else {**settings, 'canvas_dims': dims, 'rendered_dims': canvas_dims}
+
+# function to downsample images (shape N * height * width) to dims (width, height), averaging over the area of each output pixel
+# whole-number factors average blocks of pixels (Image.reduce), and other sizes are resized with a box filter
+def downsample_ims(ims, dims):
+    fx, fy = ims.shape[2] / dims[0], ims.shape[1] / dims[1]
+    out = np.zeros((len(ims), dims[1], dims[0]), dtype=np.uint8)
+    for i, im in enumerate(ims):
+        if fx == int(fx) and fy == int(fy):
+            out[i] = Image.fromarray(im).reduce((int(fx), int(fy)))
+        else:
+            out[i] = Image.fromarray(im).resize(dims, Image.BOX)
+    return out
+
+# function to scale the sample parameters from generate_unit to match images downsampled by scale (output width / canvas width)
+# (positions are in continuous pixel coordinates, so scale directly, as does the font size)
+def scale_params(params, scale, decimals=decimals):
+    return params.assign(**{col: (params[col].to_numpy() * scale).round(decimals) for col in ['x', 'y', 'size']})
+
+# function to get a random number generator for one (letter, font) work unit
+# the stream depends only on the master seed and the unit's key, so output doesn't depend on the number of workers or the order that units finish in
+# epochs other than 0 get their own independent streams (epoch 0 is the dataset written by main)
+def get_unit_rng(seed, letter, font_file, epoch=0):
+    font_key = int.from_bytes(hashlib.sha256(Path(font_file).name.encode('utf-8')).digest()[:8], 'little')
+    spawn_key = (ord(letter), font_key) if epoch == 0 else (ord(letter), font_key, epoch)
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawn_key))
+
+# function to get the parameters for n samples of a letter in a font, as arrays of x, y, size, and rotation, all of which are
+# guaranteed to keep the letter on the canvas, so nothing is rendered only to be thrown away
+# the samples are a design over the unit hypercube (see __sampling__.get_unit_design) scaled to the range of each parameter in turn:
+# rotation to rotation_bounds; size to size_bounds, capped at the largest size at which the rotated letter fits on the canvas; and
+# x and y to the positions at which the rotated letter at that size stays on the canvas (all after rounding to decimals)
+# positions are bounded by the letter's box measured at each sampled size, so they match the check in render_text_array exactly
+# only samples start to stop (of n) are returned, but the design is always drawn for the whole unit, so a sample's parameters don't
+# depend on which chunk of the unit it is generated in
+def get_unit_params(letter, font_file, n, rng, design='uniform', canvas_dims=canvas_dims, rotation_bounds=rotation_bounds,
+                    size_bounds=size_bounds, decimals=decimals, max_shrinks=10, start=0, stop=None):
+    u = __sampling__.get_unit_design(rng, n, 4, design=design)[start:stop]  # columns: rotation, size, x, y
+
+    rotation_vals = (rotation_bounds[0] + (rotation_bounds[1] - rotation_bounds[0]) * u[:, 0]).round(decimals)
+
+    # rounding down the maximum size means that the rounded sizes can't exceed it
+    max_sizes = np.floor(get_max_fitting_sizes(letter, font_file=font_file, rotations=rotation_vals, canvas_dims=canvas_dims) * 10**decimals) / 10**decimals
+    if np.any(max_sizes < size_bounds[0]):
+        warnings.warn(f'"{letter}" in {font_file} only fits on the canvas at sizes below {size_bounds[0]} at some rotations - using the largest size that fits')
+    size_high = np.minimum(size_bounds[1], max_sizes)
+    size_low = np.minimum(size_bounds[0], size_high)
+    size_vals = np.minimum((size_low + (size_high - size_low) * u[:, 1]).round(decimals), max_sizes)
+
+    # the maximum sizes come from scaled boxes, which are only estimates, so measure the box at each sampled size (as rendering does)
+    # and shrink any sample that still doesn't fit in proportion to how far its rotated box overflows the canvas, until all of them fit
+    bboxes = measure_letter_bboxes(letter, font_file=font_file, font_sizes=size_vals)
+    for attempt in range(max_shrinks + 1):
+        # get the letter vertices after rotation (used to ensure that the letter stays on the canvas)
+        # shape: N * 4 (tl, tr, br, bl) * 2 (x, y)
+        letter_verts = np.stack([np.stack(v, axis=-1) for v in rotate_bbox_to_vertices(bboxes.T, rotation=rotation_vals)], axis=1)
+        extent = letter_verts.max(axis=1) - letter_verts.min(axis=1)  # shape N * 2 (width, height)
+        with np.errstate(divide='ignore'):
+            fit = np.min((np.array(canvas_dims) - 1) / extent, axis=1)
+        too_big = fit < 1
+        if not np.any(too_big):
+            break
+        if attempt == max_shrinks:
+            raise ValueError(f'Could not find a size at which "{letter}" in {font_file} fits on the canvas at rotations {rotation_vals[too_big]}')
+        # (boxes are whole pixels, so aim a pixel inside the canvas, or a shrink too small to change the box would never converge)
+        with np.errstate(divide='ignore'):
+            shrink = np.min((np.array(canvas_dims) - 2) / extent[too_big], axis=1)
+        size_vals[too_big] = np.floor(size_vals[too_big] * shrink * 10**decimals) / 10**decimals
+        bboxes[too_big] = measure_letter_bboxes(letter, font_file=font_file, font_sizes=size_vals[too_big])
+
+    # set the bounds for x and y location so that the letters don't exceed the canvas
+    # (vertices are relative to the letter's centre, so the bounds are signed; rounding to decimals can move a vertex past a bound by less
+    # than half a pixel, which check_canvas_bounds allows for)
+    x_low, x_high = -letter_verts[:, :, 0].min(axis=1), canvas_dims[0] - 1 - letter_verts[:, :, 0].max(axis=1)
+    y_low, y_high = -letter_verts[:, :, 1].min(axis=1), canvas_dims[1] - 1 - letter_verts[:, :, 1].max(axis=1)
+
+    x_vals = np.round(x_low + (x_high - x_low) * u[:, 2], decimals)
+    y_vals = np.round(y_low + (y_high - y_low) * u[:, 3], decimals)
+
+    return x_vals, y_vals, size_vals, rotation_vals
+
+# function to generate all the images for one combination of letter and font (a work unit), or for samples start to stop of it
+# returns a dataframe of the sample parameters, and the images as an array of shape N * height * width
+def generate_unit(letter, font_file, n_samples=n_samples, seed=seed, canvas_dims=canvas_dims, rotation_bounds=rotation_bounds,
+                  size_bounds=size_bounds, decimals=decimals, epoch=0, design='uniform', start=0, stop=None):
+    import pandas as pd
+    stop = n_samples if stop is None else stop
+    rng = get_unit_rng(seed, letter, font_file, epoch=epoch)
+    x_vals, y_vals, size_vals, rotation_vals = get_unit_params(letter, font_file, n_samples, rng, design=design, canvas_dims=canvas_dims,
+                                                               rotation_bounds=rotation_bounds, size_bounds=size_bounds, decimals=decimals,
+                                                               start=start, stop=stop)
+
+    # generate images for this letter and font
+    ims = np.zeros((stop - start, canvas_dims[1], canvas_dims[0]), dtype=np.uint8)
+    for i, (X, Y, S, R) in enumerate(zip(x_vals, y_vals, size_vals, rotation_vals)):
+        render_text_array(letter=letter, font_file=font_file, x=X, y=Y, font_size=S, rotation=R, canvas_dims=canvas_dims, out=ims[i])
+
+    params = pd.DataFrame({'letter': letter, 'font': font_file, 'sample': np.arange(start, stop),
+                           'x': x_vals, 'y': y_vals, 'size': size_vals, 'rotation': rotation_vals})
+
+    return params, ims
+
+# function to run generate_unit, also returning the time it took and the number of fonts it had to load (for the run report)
+def generate_unit_timed(letter, font_file, n_samples=n_samples, start=0, stop=None, **kwargs):
+    font_loads = load_font.cache_info().misses
+    (params, ims), seconds = __instrument__.timed_call(generate_unit, letter, font_file, n_samples, start=start, stop=stop, **kwargs)
+    return params, ims, seconds, load_font.cache_info().misses - font_loads
+
+# function to map fn over a list of argument tuples in a process pool, yielding results in input order
+# at most max_pending units are in flight at once, so finished results can't pile up in memory while waiting on a slow unit
+def ordered_pool_map(fn, args_list, n_workers, max_pending=None):
+    max_pending = max_pending or 4 * n_workers
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = deque()
+        for args in args_list:
+            pending.append(executor.submit(fn, *args))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()  # re-raises any error from the worker
+        while pending:
+            yield pending.popleft().result()
+
+# function to stream batches of images straight from the renderer, without writing anything to disk
+# yields tuples of (images, params), where images is a uint8 array of shape batch_size * height * width (the last batch may be smaller),
+# and params is a dataframe with a row per image
+# images are generated for n_samples of every combination of letters and fonts, or else for the units in a sampling plan (see get_sampling_plan)
+# batches are deterministic for a given seed, epoch, and design (epoch 0 matches the images written by main), and start_batch resumes from a given batch index
+def iter_batches(batch_size=64, fonts=None, letters=letters, n_samples=n_samples, plan=None, seed=seed, epoch=0, start_batch=0, n_workers=1,
+                 canvas_dims=canvas_dims, rotation_bounds=rotation_bounds, size_bounds=size_bounds, decimals=decimals, design='uniform'):
+    import pandas as pd
+    if plan is None and fonts is None:
+        fonts = get_google_font_list()
+    chunks = get_unit_chunks(get_units(letters, fonts, n_samples=n_samples, plan=plan))
+
+    # skip any chunks of units that are wholly before the start batch, without rendering them
+    start_sample = start_batch * batch_size
+    chunk_ends = np.cumsum([stop - start for _, _, _, start, stop in chunks])
+    first_chunk = int(np.searchsorted(chunk_ends, start_sample, side='right'))
+    skip_in_unit = start_sample - (chunk_ends[first_chunk-1] if first_chunk > 0 else 0)
+    chunks = chunks[first_chunk:]
+
+    unit_fun = partial(generate_unit_timed, seed=seed, canvas_dims=canvas_dims, rotation_bounds=rotation_bounds,
+                       size_bounds=size_bounds, decimals=decimals, epoch=epoch, design=design)
+
+    if n_workers == 1:
+        results = (unit_fun(*chunk) for chunk in chunks)
+    else:
+        results = ordered_pool_map(unit_fun, chunks, n_workers=n_workers)
+
+    batch_ims = np.zeros((batch_size, canvas_dims[1], canvas_dims[0]), dtype=np.uint8)
+    batch_params = []
+    n = 0  # number of images in the current batch
+
+    for params, ims, _, _ in results:
+        params, ims = params.iloc[skip_in_unit:], ims[skip_in_unit:]
+        skip_in_unit = 0
+
+        start = 0
+        while start < len(ims):
+            n_take = min(batch_size - n, len(ims) - start)
+            batch_ims[n:n+n_take] = ims[start:start+n_take]
+            batch_params.append(params.iloc[start:start+n_take])
+            n += n_take
+            start += n_take
+            if n == batch_size:
+                yield batch_ims.copy(), pd.concat(batch_params, ignore_index=True)
+                batch_params = []
+                n = 0
+
+    if n > 0:
+        yield batch_ims[:n].copy(), pd.concat(batch_params, ignore_index=True)
+
+# the job can be split across several nodes by running a job shard (0 to num_shards-1) on each, with the same settings
+# each job shard writes its part of the dataset to its own directory in ims, and merge_shards then combines them
+# (job shards are unrelated to output_format='shards', which sets how the images are saved)
+# each image is rendered once at canvas_dims, and can also be saved at smaller resolutions (canvas widths), by downsampling it in the
+# same pass, so the letter has the same placement at every resolution (see get_resolution_outputs for where these are saved)
+def main(n_workers=1, seed=seed, output_format='png', shard_size=4096, overwrite=False, total_images=None, report=None,
+         compress_level=6, compress_type='default', writer_threads=4, shard=None, num_shards=1, design='uniform', resolutions=()):
+    report = __instrument__.RunReport() if report is None else report
+    fonts = get_google_font_list()
+
+    # spread a fixed budget of images by letter and font usage, or else generate n_samples of every combination
+    plan = None if total_images is None else get_sampling_plan(total_images)
+    units = get_units(letters, fonts, n_samples=n_samples, plan=plan)
+
+    outputs = get_resolution_outputs(resolutions)
+    settings = get_output_settings(seed=seed, output_format=output_format, shard_size=shard_size, plan=plan, design=design)
+
+    if num_shards > 1:
+        if shard is None:
+            raise ValueError(f'The job is split into {num_shards} shards, so the shard to run must be given')
+        units = get_shard_units(units, shard, num_shards)
+        outputs = [(__output__.get_part_dir(ims_path, shard, num_shards), dims) for ims_path, dims in outputs]
+        settings = {**settings, 'shard': shard, 'num_shards': num_shards}
+        print(f'Running job shard {shard} of {num_shards} (0-indexed), with {len(units)} letter and font combinations from {len({F for _, F, _ in units})} fonts.')
+
+    print(f'Will generate {sum(n for _, _, n in units)} images in total' + (f', at {len(outputs)} resolutions.' if len(outputs) > 1 else '.'))
+
+    # resume from any previous run with the same settings, unless overwriting
+    # (each resolution is a separate dataset, with its own settings and manifest)
+    writers, written = [], []
+    for ims_path, dims in outputs:
+        manifest = __output__.prepare_output_dir(ims_path, settings=get_resolution_settings(settings, dims), overwrite=overwrite)
+        if output_format == 'png':
+            writers.append(__output__.PNGWriter(ims_path, letters=letters, manifest=manifest, compress_level=compress_level, compress_type=compress_type,
+                                                n_threads=writer_threads))
+        elif output_format == 'shards':
+            writers.append(__output__.ShardWriter(ims_path, canvas_dims=dims, shard_size=shard_size, manifest=manifest))
+        else:
+            raise ValueError(f'Unknown output format "{output_format}" - expected "png" or "shards"')
+        written.append(manifest.get_written())
+
+    # each (letter, font) combination is a work unit with its own random number stream
+    # units that are already complete (at every resolution) are skipped, and partly written units only write their remaining samples
+    # (with a sampling plan, a unit's samples depend on its count, so a changed plan counts as changed settings)
+    n_units = len(units)
+    units = [(L, F, n) for L, F, n in units if any(w.get((L, F), 0) < n for w in written)]
+    if any(len(w) > 0 for w in written):
+        print(f'{n_units - len(units)} letter and font combinations already complete; generating the remaining {len(units)}')
+
+    # units are generated in chunks of at most max_chunk_samples, skipping chunks that are already written
+    chunks = [(L, F, n, start, stop) for L, F, n, start, stop in get_unit_chunks(units) if any(w.get((L, F), 0) < stop for w in written)]
+
+    unit_fun = partial(generate_unit_timed, seed=seed, canvas_dims=canvas_dims, rotation_bounds=rotation_bounds,
+                       size_bounds=size_bounds, decimals=decimals, design=design)
+
+    if n_workers == 1:
+        results = (unit_fun(*chunk) for chunk in chunks)
+    else:
+        results = ordered_pool_map(unit_fun, chunks, n_workers=n_workers)
+
+    # generate all images, writing them in unit order
+    # render time is measured in the worker for each unit, so it is known per font even with several workers
+    # pngs are encoded and saved in the background, so the write time here is only the time spent waiting for space in the writer's queue
+    with report.stage('generate_images'):
+        for (L, F, n, start, stop), (params, ims, render_seconds, font_loads) in tqdm(zip(chunks, results), total=len(chunks), desc='Generating images'):
+            for (_, dims), writer, out_written in zip(outputs, writers, written):
+                n_skip = max(0, out_written.get((L, F), 0) - start)  # samples of this chunk already written
+                if n_skip >= len(ims):
+                    continue
+                out_params, out_ims = params.iloc[n_skip:], ims[n_skip:]
+                if dims != tuple(canvas_dims):
+                    (out_params, out_ims), downsample_seconds = __instrument__.timed_call(
+                        lambda: (scale_params(out_params, dims[0] / canvas_dims[0]), downsample_ims(out_ims, dims)))
+                    report.count('downsample_seconds', downsample_seconds)
+                _, write_wait_seconds = __instrument__.timed_call(writer.write, out_params, out_ims)
+                report.count('images_written', len(out_ims))
+                report.count('write_wait_seconds', write_wait_seconds)
+            report.add_font_time('render', F, render_seconds, n=len(ims))
+            report.count('units_generated', int(stop == n))
+            report.count('images_rendered', len(ims))
+            report.count('font_loads', font_loads)  # a font file at a given size
+            report.count('render_seconds', render_seconds)
+        for writer in writers:
+            writer.close()
+
+    # index every sample, with its font's info, so that subsets can be selected without reading any images (see __output__.load_index)
+    with report.stage('write_index'):
+        font_df = get_font_info()
+        for ims_path, _ in outputs:
+            __output__.write_index(ims_path, output_format=output_format, font_df=font_df)
+    for writer in writers:
+        report.count('bytes_written', writer.bytes_written)
+        report.count('encode_seconds', writer.encode_seconds)
+        report.count('io_seconds', writer.io_seconds)
+
+    return report
+
+# function to merge the output of the job shards of a sharded run (see main) into a single dataset in ims (and one for each extra
+# resolution), as though it had been generated in one run (the settings must be the same as the job shards were run with)
+# job shards that have already been merged are skipped, but every job shard must be complete
+def merge_shards(num_shards, seed=seed, output_format='png', shard_size=4096, total_images=None, design='uniform', resolutions=()):
     fonts = get_google_font_list()
-    letters = [*ascii_letters, 'ä', 'ö', 'ü', 'Ä', 'Ö', 'Ü', 'ß']
-    print(f'Will generate {n_samples * len(fonts) * len(letters)} images in total.')
-
-    canvas_dims = (256, 256)
-    rotation_bounds = (-15, 15)
-    size_bounds = (16, 0.5*max(canvas_dims))
-    decimals = 3  # number of decimals to round all variables to
-    ims_path = Path('ims')
-
-    if ims_path.exists():
-        print('Removing existing ims directory...')
-        shutil.rmtree(ims_path)
-    
-    # generate all images
-    for L in (pbar:=tqdm(letters, desc='Generating images')):
-        pbar.set_postfix_str(L)
-        case_lab = 'lwr' if L.islower() else 'upr'
-        save_dir = ims_path / Path(f'{L}_{case_lab}')
-        save_dir.mkdir(parents=True, exist_ok=True)
-
-        for F in fonts:
-            rotation_vals = np.random.uniform(low=rotation_bounds[0], high=rotation_bounds[1], size=n_samples).round(decimals)
-            size_vals = np.random.uniform(low=size_bounds[0], high=size_bounds[1], size=n_samples).round(decimals)
-
-            # get the letter vertices after rotation (used to ensure that the letter stays on the canvas)
-            # shape: N * 4 (tl, tr, br, bl) * 2 (x, y)
-            letter_verts = np.array([get_letter_vertices(letter=L, font_file=F, font_size=S, rotation=R)
-                                     for S, R in zip(size_vals, rotation_vals)])
-            
-            min_x = letter_verts[:, :, 0].min(axis=1)
-            max_x = letter_verts[:, :, 0].max(axis=1)
-            min_y = letter_verts[:, :, 1].min(axis=1)
-            max_y = letter_verts[:, :, 1].max(axis=1)
-
-            # set the bounds for x and y location so that the letters don't exceed the canvas
-            # (depends on size and rotation values)
-            x_trans_bounds = np.array([0 + abs(min_x), canvas_dims[0] - 1 - abs(max_x)])
-            y_trans_bounds = np.array([0 + abs(min_y), canvas_dims[0] - 1 - abs(max_y)])
-
-            x_vals = np.round( np.random.uniform(low=x_trans_bounds[0, :], high=x_trans_bounds[1, :], size=n_samples), decimals )
-            y_vals = np.round( np.random.uniform(low=y_trans_bounds[0, :], high=y_trans_bounds[1, :], size=n_samples), decimals )
-
-            # generate images for this letter and font
-            ims = [render_text_im(letter=L, font_file=F, x=X, y=Y, font_size=S, rotation=R, canvas_dims=canvas_dims)
-                   for X, Y, S, R in zip(x_vals, y_vals, size_vals, rotation_vals)]
-            
-            # save to file
-            file_names = [f'font-{Path(F).stem.replace(".", "-")}_x{X}_y{Y}_sz{S}_rot{R}'.replace('.', 'p')
-                          for X, Y, S, R in zip(x_vals, y_vals, size_vals, rotation_vals)]
-
-            for im, fn in zip(ims, file_names):
-                im.save(save_dir / f'{fn}.png')
+    plan = None if total_images is None else get_sampling_plan(total_images)
+    units = get_units(letters, fonts, n_samples=n_samples, plan=plan)
+    settings = get_output_settings(seed=seed, output_format=output_format, shard_size=shard_size, plan=plan, design=design)
+    font_df = get_font_info()
+
+    for ims_path, dims in get_resolution_outputs(resolutions):
+        merged_written = __output__.Manifest(ims_path).get_written()
+        part_paths = []
+        for shard in range(num_shards):
+            part_path = __output__.get_part_dir(ims_path, shard, num_shards)
+            part_written = __output__.Manifest(part_path).get_written()
+            n_missing = sum(merged_written.get((L, F), 0) + part_written.get((L, F), 0) < n for L, F, n in get_shard_units(units, shard, num_shards))
+            if n_missing > 0:
+                raise ValueError(f'Job shard {shard} is incomplete in {ims_path} ({n_missing} letter and font combinations missing) - run it with --shard {shard} --num-shards {num_shards} before merging')
+            if part_path.exists():
+                part_paths.append(part_path)
+
+        __output__.merge_parts(ims_path, part_paths, settings=get_resolution_settings(settings, dims))
+        __output__.write_index(ims_path, output_format=output_format, font_df=font_df)
+        print(f'Merged {len(part_paths)} job shards into {ims_path}')
 
     return None
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Generate letter images from the fonts in freqs/font_frequencies.csv')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes to generate images with (default: 1)')
+    parser.add_argument('--seed', type=int, default=seed, help='master random seed')
+    parser.add_argument('--output', choices=['png', 'shards'], default='png', help='save a png per image, or fixed-size shards of image arrays with a parquet table of parameters')
+    parser.add_argument('--shard-size', type=int, default=4096, help='number of images per shard when using --output shards')
+    parser.add_argument('--overwrite', action='store_true', help='remove any existing images and start again, rather than resuming')
+    parser.add_argument('--total-images', type=int, default=None, help='spread this many images across letters and fonts in proportion to their usage, rather than a fixed number per combination')
+    parser.add_argument('--compress-level', type=int, default=6, choices=range(10), help='png compression level, from 0 (none, fastest) to 9 (smallest files)')
+    parser.add_argument('--compress-type', default='default', choices=list(__output__.png_compress_types), help='zlib strategy for png compression (rle suits mostly-blank images)')
+    parser.add_argument('--writer-threads', type=int, default=4, help='number of background threads that encode and save pngs (0 to save in the main thread)')
+    parser.add_argument('--report', default=None, help='file to save a run report (json) of timings and counts to')
+    parser.add_argument('--design', choices=__sampling__.designs, default='uniform', help='how to sample sizes, rotations, and positions: independently (uniform), as a latin hypercube (lhs), or on a grid of sizes and rotations (grid)')
+    parser.add_argument('--resolutions', nargs='*', type=int, default=[], help=f'also save every image downsampled to these canvas widths (e.g., 128 64), rendering each image once at {canvas_dims[0]} pixels wide')
+    parser.add_argument('--shard', type=int, default=None, help='job shard to run (0 to --num-shards minus 1), to split generation across nodes')
+    parser.add_argument('--num-shards', type=int, default=1, help='number of job shards that generation is split across')
+    parser.add_argument('--merge', action='store_true', help='merge the output of all --num-shards job shards into one dataset, instead of generating')
+    args = parser.parse_args()
+    if args.merge:
+        merge_shards(args.num_shards, seed=args.seed, output_format=args.output, shard_size=args.shard_size, total_images=args.total_images,
+                     design=args.design, resolutions=args.resolutions)
+    else:
+        report = main(n_workers=args.workers, seed=args.seed, output_format=args.output, shard_size=args.shard_size, overwrite=args.overwrite, total_images=args.total_images,
+                      compress_level=args.compress_level, compress_type=args.compress_type, writer_threads=args.writer_threads,
+                      shard=args.shard, num_shards=args.num_shards, design=args.design, resolutions=args.resolutions)
+        report.print_summary()
+        if args.report is not None:
+            report.save(args.report)
@@ -2,23 +2,53 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 from string import ascii_letters
-from tqdm import tqdm
 
 letters = [*ascii_letters, 'ä', 'ö', 'ü', 'Ä', 'Ö', 'Ü', 'ß']
 
-def get_freqs(letters=letters):
-    # calculate letter frequencies from SUBTLEX-DE word frequencies
-    wf_df = pd.read_csv(Path('data') / 'SUBTLEX-DE_cleaned_with_Google00_frequencies.csv', encoding='utf-8')
+# function to stream the SUBTLEX-DE words in chunks, as a flat array of unicode codepoints, with a 0 after each word,
+# and the corresponding word frequency counts for each codepoint
+def iter_subtlex_codepoints(chunksize=100000):
+    wf_chunks = pd.read_csv(Path('data') / 'SUBTLEX-DE_cleaned_with_Google00_frequencies.csv', encoding='utf-8',
+                            usecols=['Word', 'WFfreqcount'], chunksize=chunksize)
+    for wf_df in wf_chunks:
+        codepoints = np.frombuffer(''.join([w + '\0' for w in wf_df.Word]).encode('utf-32-le'), dtype=np.uint32)
+        codepoint_wts = np.repeat(wf_df.WFfreqcount.to_numpy(), repeats=wf_df.Word.str.len() + 1)
+        yield codepoints, codepoint_wts
+
+# function to count how often each letter (and, optionally, each pair of adjacent letters within a word) appears in SUBTLEX-DE,
+# weighted by the frequency of the words they appear in
+# this is a single pass over the corpus, counting all letters at once with np.bincount, and works for any alphabet
+# returns an array of letter counts, and if bigrams=True, a matrix of counts for each (first letter, second letter)
+def count_letters(letters=letters, bigrams=False, chunksize=100000):
+    n_letters = len(letters)
+
+    # lookup table from codepoint to position in letters (-1 for characters that aren't in letters, including the 0 between words)
+    letter_idx = np.full(0x110000, -1, dtype=np.int32)
+    letter_idx[[ord(L) for L in letters]] = np.arange(n_letters)
 
-    # flat array of all letters, collapsed across words
-    subtlex_chars = np.array([L for w in wf_df.Word for L in w])
+    letter_counts = np.zeros(n_letters)
+    bigram_counts = np.zeros(n_letters * n_letters)
 
-    # get the corresponding counts of word frequency, from the words the letters belong to
-    nchars = wf_df.Word.str.len()
-    subtlex_char_wts = np.repeat(wf_df.WFfreqcount.to_numpy(), repeats=nchars)
-    
-    # now calculate total letter counts as the total number of times the letter has appeared, weighted by the frequency of the words they appeared in
-    subtlex_char_counts = np.array([subtlex_char_wts[subtlex_chars==L].sum() for L in letters])
+    for codepoints, codepoint_wts in iter_subtlex_codepoints(chunksize=chunksize):
+        idx = letter_idx[codepoints]
+        is_letter = idx >= 0
+        letter_counts += np.bincount(idx[is_letter], weights=codepoint_wts[is_letter], minlength=n_letters)
+
+        if bigrams:
+            # pairs of letters next to each other (never across words, as words are separated by a non-letter)
+            is_bigram = is_letter[:-1] & is_letter[1:]
+            bigram_idx = idx[:-1][is_bigram] * n_letters + idx[1:][is_bigram]
+            bigram_counts += np.bincount(bigram_idx, weights=codepoint_wts[:-1][is_bigram], minlength=n_letters * n_letters)
+
+    letter_counts = np.rint(letter_counts).astype(np.int64)
+    if bigrams:
+        return letter_counts, np.rint(bigram_counts).astype(np.int64).reshape(n_letters, n_letters)
+    return letter_counts
+
+def get_freqs(letters=letters):
+    # calculate letter frequencies from SUBTLEX-DE word frequencies
+    # letter counts are the total number of times the letter has appeared, weighted by the frequency of the words they appeared in
+    subtlex_char_counts = count_letters(letters)
 
     out_df = pd.DataFrame({'letter': letters,
                            'n': subtlex_char_counts,
@@ -26,6 +56,17 @@ def get_freqs(letters=letters):
 
     return out_df
 
+# function to get the frequencies of pairs of adjacent letters within words, in the same way as get_freqs
+def get_bigram_freqs(letters=letters):
+    _, bigram_counts = count_letters(letters, bigrams=True)
+
+    out_df = pd.DataFrame({'first': np.repeat(letters, len(letters)),
+                           'second': np.tile(letters, len(letters)),
+                           'n': bigram_counts.ravel(),
+                           'p': bigram_counts.ravel()/bigram_counts.sum()})
+
+    return out_df
+
 def main():
     freqs_path = Path('freqs')
     freqs_path.mkdir(exist_ok=True)
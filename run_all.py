@@ -1,13 +1,111 @@
 import get_letter_freqs
 import get_google_fonts
 import generate_images
+import __fonts__
+import __instrument__
+import __sampling__
+import __pipeline__
+from pathlib import Path
+import argparse
+import time
+
+# function to profile a single font and/or letter, without running the rest of the pipeline
+# with a font, that font is validated and then generated for every letter (or just the given letter)
+# with only a letter, that letter is generated for every font in freqs/font_frequencies.csv, and the slowest fonts are reported
+def profile_target(font=None, letter=None, out_path=None):
+    report = __instrument__.RunReport()
+    fonts = [font] if font is not None else generate_images.get_google_font_list()
+    letters = [letter] if letter is not None else generate_images.letters
+
+    def run_target():
+        if font is not None:
+            with report.stage('validate_fonts'):
+                ok, seconds = __instrument__.timed_call(__fonts__.font_succeeds, get_google_fonts.test_letters, font=font,
+                                                        font_size=get_google_fonts.test_font_size,
+                                                        canvas_dims=[get_google_fonts.test_font_size*3]*2)
+            report.add_font_time('validate', font, seconds)
+            print(f'{font} {"passes" if ok else "fails"} validation')
+        with report.stage('generate_images'):
+            for F in fonts:
+                for L in letters:
+                    _, ims, seconds, font_loads = generate_images.generate_unit_timed(L, F)
+                    report.add_font_time('render', F, seconds, n=len(ims))
+                    report.count('images_rendered', len(ims))
+                    report.count('font_loads', font_loads)  # a font file at a given size
+
+    __instrument__.profile_call(run_target, out_path=out_path)
+    report.print_summary(k=10)
+    return report
+
+code_dir = Path(__file__).resolve().parent
+
+# the stages of the pipeline are run in worker processes, with these functions
+def letter_freqs_stage(report):
+    with report.stage('get_letter_freqs'):
+        get_letter_freqs.main()
+
+def google_fonts_stage(report, n_workers=None):
+    with report.stage('get_google_fonts'):
+        get_google_fonts.main(n_workers=n_workers, report=report)
+
+def images_stage(report, **kwargs):
+    generate_images.main(report=report, **kwargs)
+
+# function to get the stages of the pipeline, with the files each one is made from (including all the code it runs) and makes
+# (font validation renders with generate_images, so that is part of the code for get_google_fonts too)
+# letter frequencies and font selection don't depend on each other, so they run at the same time, and image generation runs after both
+# (the google-fonts and analytics repositories are checked out at fixed commits in get_google_fonts.py, so they're covered by its code)
+# the image dataset is tracked by the settings, manifest, and index of each output directory
+def get_stages(n_workers=None, seed=generate_images.seed, output_format='png', total_images=None, design='uniform', resolutions=(), overwrite=False):
+    ims_outputs = [ims_path / f for ims_path, _ in generate_images.get_resolution_outputs(resolutions)
+                   for f in ['settings.json', 'manifest.jsonl', 'index.parquet']]
+    return [
+        __pipeline__.Stage('get_letter_freqs', letter_freqs_stage,
+                           inputs=[code_dir / 'get_letter_freqs.py', Path('data') / 'SUBTLEX-DE_cleaned_with_Google00_frequencies.csv'],
+                           outputs=[Path('freqs') / 'letter_frequencies.csv']),
+        __pipeline__.Stage('get_google_fonts', google_fonts_stage,
+                           inputs=[code_dir / 'get_google_fonts.py', code_dir / '__fonts__.py', code_dir / '__fonts_public_pb2__.py',
+                                   code_dir / 'generate_images.py', code_dir / '__instrument__.py', Path('data') / 'bad_fonts.csv'],
+                           outputs=[Path('freqs') / 'font_frequencies.csv'],
+                           options={'n_workers': n_workers}),
+        __pipeline__.Stage('generate_images', images_stage, deps=['get_letter_freqs', 'get_google_fonts'],
+                           inputs=[code_dir / 'generate_images.py', code_dir / '__output__.py', code_dir / '__sampling__.py', code_dir / '__instrument__.py',
+                                   Path('freqs') / 'letter_frequencies.csv', Path('freqs') / 'font_frequencies.csv'],
+                           outputs=ims_outputs,
+                           params={'seed': seed, 'output_format': output_format, 'total_images': total_images, 'design': design,
+                                   'resolutions': sorted(resolutions)},
+                           options={'n_workers': 1 if n_workers is None else n_workers, 'overwrite': overwrite}),
+    ]
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the whole pipeline (letter frequencies, font selection, and image generation), skipping stages that are up to date')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes to test fonts and generate images with (default: all CPUs to test fonts, 1 to generate images)')
+    parser.add_argument('--seed', type=int, default=generate_images.seed, help='random seed for generating images')
+    parser.add_argument('--output', choices=['png', 'shards'], default='png', help='save images as pngs, or as numpy shards')
+    parser.add_argument('--total-images', type=int, default=None, help='total number of images, spread over letters and fonts by how often they are used')
+    parser.add_argument('--design', choices=__sampling__.designs, default='uniform', help='how to spread the placement parameters of each letter and font')
+    parser.add_argument('--resolutions', nargs='*', type=int, default=[], help='canvas widths to also save images at')
+    parser.add_argument('--overwrite', action='store_true', help='delete any existing images, instead of resuming, if image generation runs')
+    parser.add_argument('--force', nargs='*', default=None, help='run these stages (or all stages, if none are given) even if they are up to date')
+    parser.add_argument('--report', default=None, help='file to save the run report (json) to (default: reports/run-<time>.json)')
+    parser.add_argument('--profile-font', default=None, help='profile validating and generating this font file only, instead of running the pipeline')
+    parser.add_argument('--profile-letter', default=None, help='profile generating this letter only (for all fonts, unless --profile-font is given), instead of running the pipeline')
+    parser.add_argument('--profile-out', default=None, help='file to save the cProfile stats to, when profiling')
+    args = parser.parse_args()
 
-    get_letter_freqs.main()
+    if args.profile_font is not None or args.profile_letter is not None:
+        profile_target(font=args.profile_font, letter=args.profile_letter, out_path=args.profile_out)
+    else:
+        report = __instrument__.RunReport()
+        report_path = args.report or Path('reports') / f'run-{time.strftime("%Y%m%d-%H%M%S")}.json'
 
-    get_google_fonts.main()
+        stages = get_stages(n_workers=args.workers, seed=args.seed, output_format=args.output, total_images=args.total_images,
+                            design=args.design, resolutions=args.resolutions, overwrite=args.overwrite)
+        force = [] if args.force is None else args.force or [stage.name for stage in stages]
+        __pipeline__.run_pipeline(stages, state_path=Path('cache') / 'pipeline_state.json', force=force, report=report)
 
-    generate_images.main()
+        report.print_summary()
+        report.save(report_path)
+        print(f'Saved run report to {report_path}')
 
-    print('Done!')
+        print('Done!')